@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# TSManager benchmark — corpus sintetis + timing per tahap + throughput batch & Auto-Watch
+# - Generate paket manifest palsu (.lua dengan komentar, .manifest biner, README opsional)
+# - Ukur tiap tahap: validate, hash, inspect (hash+validate), clean, repack, copy
+# - Ukur end-to-end: run_batch (manual Run) dan WatcherThread (Auto-Watch)
+# - Cek: versi baru appid yang sama (incremental) byte-identik dengan repack penuh, versi yang isinya sama
+#   (hanya timestamp / kompresi sumber beda) tidak menulis ulang CLEAN_DIR/DRIVE_DIR (exit 1 bila gagal)
+# - Hasil: files/s, MB/s, peak RSS -> JSON (bandingkan antar versi dengan --compare)
+#
+# Contoh:
+#   python bench/bench_tsmanager.py --count 200 --out bench_1.3.0.json
+#   python bench/bench_tsmanager.py --count 200 --compare bench_1.3.0.json
+#
+# Semua state (history DB, index, cache) ditaruh di workdir sementara, bukan di folder app.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+import TSManager as ts  # noqa: E402
+
+# ========= CORPUS GENERATOR =========
+_LUA_CODE = [
+    'addappid({id}, 1, "{hex}")',
+    'setManifestid({id}, "{num}", 0)',
+    'local depot_{id} = {{ id = {id}, key = "{hex}" }}',
+    'if depot_{id} then addtoken({id}, "{hex}") end',
+]
+_LUA_COMMENT = [
+    "-- {text}",
+    "    -- indented {text}",
+    "--[[ block {text}\n  still block ]]",
+]
+
+def _lua_source(rnd, target_bytes, comment_density):
+    out, size = [], 0
+    while size < target_bytes:
+        if rnd.random() < comment_density:
+            line = rnd.choice(_LUA_COMMENT).format(text=f"note {rnd.getrandbits(32):08x}")
+        else:
+            line = rnd.choice(_LUA_CODE).format(
+                id=rnd.randint(10, 3_000_000), hex=f"{rnd.getrandbits(256):064x}",
+                num=rnd.getrandbits(63))
+        out.append(line)
+        size += len(line) + 1
+    return "\n".join(out) + "\n"
+
+def generate_corpus(out_dir, count, lua_files=2, lua_kb=16, comment_density=0.3,
+                    manifest_files=3, manifest_kb=256, readme=True, seed=1):
+    """Tulis `count` zip manifest palsu ke out_dir. Return list path."""
+    os.makedirs(out_dir, exist_ok=True)
+    rnd = random.Random(seed)
+    paths = []
+    for i in range(count):
+        appid = 100000 + i
+        path = os.path.join(out_dir, f"{appid}.zip")
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as z:
+            for j in range(lua_files):
+                z.writestr(f"{appid}_{j}.lua", _lua_source(rnd, lua_kb * 1024, comment_density))
+            for j in range(manifest_files):
+                # .manifest asli sudah terkompresi -> isi acak (tidak bisa dikompres)
+                z.writestr(f"{appid + j}_{rnd.getrandbits(60)}.manifest", rnd.randbytes(manifest_kb * 1024))
+            if readme:
+                z.writestr("README.txt", "Generated by bench_tsmanager\n")
+        paths.append(path)
+    return paths
+
+# ========= MEASUREMENT =========
+def peak_rss_mb():
+    """Peak RSS proses ini + child (process pool), MB. None bila tidak tersedia."""
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024  # macOS: bytes, Linux: KB
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        kids = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+        return round(max(own, kids) / (1 << 20), 1)
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PMC(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        pmc = PMC()
+        pmc.cb = ctypes.sizeof(PMC)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(pmc), pmc.cb):
+            return round(pmc.PeakWorkingSetSize / (1 << 20), 1)
+    except Exception:
+        pass
+    return None
+
+def _rate(files, nbytes, seconds):
+    seconds = max(seconds, 1e-9)
+    return {
+        "files": files,
+        "mb": round(nbytes / (1 << 20), 2),
+        "seconds": round(seconds, 4),
+        "files_per_s": round(files / seconds, 2),
+        "mb_per_s": round(nbytes / (1 << 20) / seconds, 2),
+    }
+
+def _timed(paths, fn):
+    nbytes = sum(os.path.getsize(p) for p in paths)
+    t0 = time.perf_counter()
+    for p in paths:
+        fn(p)
+    return _rate(len(paths), nbytes, time.perf_counter() - t0)
+
+class _NullLogger:
+    def log(self, msg):
+        pass
+
+    def alert(self, title, msg):
+        pass
+
+def _isolate_state(workdir):
+    """Arahkan semua file state TSManager ke workdir supaya benchmark tidak menyentuh data asli."""
+    ts.LOGS_DIR = os.path.join(workdir, "logs")
+    ts.HISTORY_DB = os.path.join(ts.LOGS_DIR, "tsmanager.db")
+    ts.HISTORY_CSV = os.path.join(ts.LOGS_DIR, "tsmanager_log.csv")
+    ts.PROCESSED_MD5_DB = os.path.join(workdir, "processed_md5.txt")
+    ts.INDEX_DIR = os.path.join(workdir, "index")
+    ts.RESULT_CACHE_DB = os.path.join(workdir, "result_cache.txt")
+    ts.WATCH_SEEN_DB = os.path.join(workdir, "watch_seen.txt")
+    ts._history = None
+    ts._result_cache = None
+    ts._member_manifest = None
+    ts._retry_queue = None
+    ts._dir_indexes.clear()
+
+def bench_stages(paths, workdir):
+    out = {}
+    out["validate"] = _timed(paths, lambda p: ts.inspect_archive(p).valid)
+    out["hash"] = _timed(paths, ts.md5_file)
+    out["inspect"] = _timed(paths, ts.md5_and_validate_zip)
+
+    # clean: hanya cleaner .lua (in-memory), tanpa repack
+    def clean(p):
+        with zipfile.ZipFile(p) as z:
+            for info in z.infolist():
+                if info.filename.lower().endswith(".lua"):
+                    with z.open(info) as src:
+                        ts.clean_lua_stream(src, _Sink())
+    out["clean"] = _timed(paths, clean)
+
+    cleaned = []
+
+    def repack(p):
+        cleaned.append(ts.process_zip_to_cleaned(p))
+    out["repack"] = _timed(paths, repack)
+
+    dst_dir = os.path.join(workdir, "copy_dst")
+    os.makedirs(dst_dir, exist_ok=True)
+    outs = [c[0] for c in cleaned]
+    digests = ts.DigestCache()
+    out["copy"] = _timed(outs, lambda p: ts.copy_auto_replace(p, os.path.join(dst_dir, os.path.basename(p)), digests))
+    out["copy_identical"] = _timed(
+        outs, lambda p: ts.copy_auto_replace(p, os.path.join(dst_dir, os.path.basename(p)), digests))
+    for _, _, tmpdir in cleaned:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return out
+
+def bench_profiles(paths):
+    """Repack corpus dengan tiap profil kompresi: MB/s, ukuran hasil, byte dihemat, CPU."""
+    out = {}
+    default = ts.COMPRESS_PROFILE
+    try:
+        for profile in ts.COMPRESS_PROFILES:
+            ts.set_compress_profile(profile)
+            raw = comp = 0
+            tmpdirs = []
+            cpu0 = time.process_time()
+
+            def repack(p):
+                nonlocal raw, comp
+                zstats = {}
+                tmpdirs.append(ts.process_zip_to_cleaned(p, zstats=zstats)[2])
+                raw += zstats["raw"]
+                comp += zstats["out"]
+            res = _timed(paths, repack)
+            res["cpu_s"] = round(time.process_time() - cpu0, 3)
+            res["out_mb"] = round(comp / (1 << 20), 2)
+            res["saved_pct"] = round((raw - comp) * 100.0 / raw, 1) if raw else 0.0
+            out[profile] = res
+            for tmpdir in tmpdirs:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+    finally:
+        ts.set_compress_profile(default)
+    return out
+
+def _write_zip(path, members, levels, date_time=(2024, 1, 1, 12, 0, 0)):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        for name, data in members.items():
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            z.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED,
+                       compresslevel=levels.get(os.path.splitext(name)[1], 6))
+
+def check_incremental(workdir, seed=1):
+    """
+    Versi baru paket (appid sama) yang diproses incremental:
+    v2 = satu .lua berubah + .manifest sama dengan kompresi lain (deflate:1 -> deflate:9)
+         -> hasil harus byte-identik dengan repack penuh;
+    v3 = isi sama persis dengan v2, hanya kompresi sumber yang berubah lagi,
+    v4 = isi sama persis, hanya timestamp member yang berubah
+         -> hasil lama dipakai, CLEAN_DIR & DRIVE_DIR tidak ditulis ulang.
+    """
+    rnd = random.Random(seed)
+    appid = "999999"
+    lua = {f"{appid}_{j}.lua": _lua_source(rnd, 16 * 1024, 0.3).encode() for j in range(2)}
+    lua[f"{appid}_plain.lua"] = _lua_source(rnd, 4 * 1024, 0.0).encode()
+    manifest = {f"{appid}_1.manifest": rnd.randbytes(64 * 1024) + bytes(64 * 1024)}
+    clean_dir, drive_dir = os.path.join(workdir, "incr_clean"), os.path.join(workdir, "incr_drive")
+    os.makedirs(clean_dir, exist_ok=True)
+    os.makedirs(drive_dir, exist_ok=True)
+    clean_target = os.path.join(clean_dir, f"{appid}.zip")
+    drive_target = os.path.join(drive_dir, f"{appid}.zip")
+    digests = ts.DigestCache()
+    out = {"ok": True, "versions": []}
+    versions = (("v1", 1, (2024, 1, 1, 12, 0, 0), "repack"),
+                ("v2", 9, (2024, 1, 1, 12, 0, 0), "repack"),
+                ("v3", 1, (2024, 1, 1, 12, 0, 0), "unchanged"),
+                ("v4", 1, (2025, 6, 1, 8, 30, 0), "unchanged"))
+    for version, level, date_time, expect in versions:
+        if version == "v2":
+            lua[f"{appid}_1.lua"] += b"-- versi 2\nsetManifestid(1, \"2\", 0)\n"
+        src_dir = os.path.join(workdir, f"incr_{version}")
+        os.makedirs(src_dir, exist_ok=True)
+        src = os.path.join(src_dir, f"{appid}.zip")
+        _write_zip(src, {**lua, **manifest}, {".manifest": level}, date_time)
+        before = [os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in (clean_target, drive_target)]
+        drive_status = ts.process_one_zip(src, clean_dir, drive_dir, _NullLogger(), digests)
+        after = [os.stat(p).st_mtime_ns for p in (clean_target, drive_target)]
+        if expect == "repack":
+            cleaned, _, tmpdir = ts.process_zip_to_cleaned(src)
+            try:
+                passed = ts.md5_file(clean_target) == ts.md5_file(cleaned)
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        else:
+            passed = drive_status == "exists-identical" and before == after
+        row = ts.get_history().query(appid=appid, limit=1)
+        out["versions"].append({"version": version, "expect": expect, "passed": passed,
+                                "drive": drive_status, "notes": row[0]["notes"] if row else ""})
+        out["ok"] = out["ok"] and passed
+    return out
+
+class _Sink:
+    def write(self, b):
+        return len(b)
+
+def bench_batch(paths, workdir, workers):
+    clean_dir = os.path.join(workdir, "batch_clean")
+    drive_dir = os.path.join(workdir, "batch_drive")
+    os.makedirs(clean_dir, exist_ok=True)
+    os.makedirs(drive_dir, exist_ok=True)
+    ts.BATCH_WORKERS = workers
+    nbytes = sum(os.path.getsize(p) for p in paths)
+    t0 = time.perf_counter()
+    results = ts.run_batch(list(paths), clean_dir, drive_dir, _NullLogger())
+    res = _rate(len(paths), nbytes, time.perf_counter() - t0)
+    res["workers"] = workers or (os.cpu_count() or 1)
+    res["results"] = dict(results)
+    return res
+
+def _finished_zips(directory):
+    """Zip yang sudah selesai di-copy (file sementara .*.tsm-part dari copy atomic tidak dihitung)."""
+    return sum(1 for name in os.listdir(directory) if name.lower().endswith(".zip") and not name.startswith("."))
+
+def bench_watcher(paths, workdir, timeout_s=600):
+    watch_dir = os.path.join(workdir, "watch_in")
+    clean_dir = os.path.join(workdir, "watch_clean")
+    drive_dir = os.path.join(workdir, "watch_drive")
+    for d in (watch_dir, clean_dir, drive_dir):
+        os.makedirs(d, exist_ok=True)
+    # isi berbeda dari corpus batch (md5 baru) supaya tidak di-skip sebagai "sudah diproses"
+    ts.get_history().flush()
+    _isolate_state(os.path.join(workdir, "watch_state"))
+
+    stop = threading.Event()
+    watcher = ts.WatcherThread([ts.WatchRoute(watch_dir, clean_dir, drive_dir)], _NullLogger(), stop)
+    watcher.start()
+    time.sleep(0.5)
+    nbytes = sum(os.path.getsize(p) for p in paths)
+    t0 = time.perf_counter()
+    for p in paths:
+        shutil.copyfile(p, os.path.join(watch_dir, os.path.basename(p)))  # mtime baru -> latency akurat
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if _finished_zips(drive_dir) >= len(paths):
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    watcher.join()
+    res = _rate(_finished_zips(drive_dir), nbytes, elapsed)
+    res["backend"] = watcher.backend_name
+    res["pickup_latency_avg_s"] = round(watcher.metrics["latency_avg_s"], 3)
+    return res
+
+# ========= COMPARE / MAIN =========
+def _flatten(result):
+    flat = {}
+    for stage, r in result.get("stages", {}).items():
+        flat[f"stage.{stage}"] = r.get("mb_per_s")
+    for profile, r in result.get("profiles", {}).items():
+        flat[f"profile.{profile}"] = r.get("mb_per_s")
+    for key in ("batch", "watcher"):
+        if key in result:
+            flat[key] = result[key].get("mb_per_s")
+    return flat
+
+def compare(old, new):
+    a, b = _flatten(old), _flatten(new)
+    print(f"{'metric':<24}{'old MB/s':>12}{'new MB/s':>12}{'ratio':>9}")
+    for k in sorted(set(a) | set(b)):
+        x, y = a.get(k), b.get(k)
+        ratio = f"{y / x:.2f}x" if x and y else "-"
+        print(f"{k:<24}{x if x is not None else '-':>12}{y if y is not None else '-':>12}{ratio:>9}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="TSManager benchmark")
+    ap.add_argument("--count", type=int, default=100, help="jumlah zip di corpus")
+    ap.add_argument("--lua-files", type=int, default=2)
+    ap.add_argument("--lua-kb", type=int, default=16)
+    ap.add_argument("--comment-density", type=float, default=0.3)
+    ap.add_argument("--manifest-files", type=int, default=3)
+    ap.add_argument("--manifest-kb", type=int, default=256)
+    ap.add_argument("--no-readme", action="store_true")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workers", type=int, default=0, help="BATCH_WORKERS untuk benchmark batch (0 = otomatis)")
+    ap.add_argument("--skip", default="", help="lewati bagian: stages,profiles,incremental,batch,watcher (pisah koma)")
+    ap.add_argument("--workdir", help="folder kerja (default: tempdir, dihapus setelah selesai)")
+    ap.add_argument("--out", help="tulis hasil JSON ke file ini")
+    ap.add_argument("--compare", help="JSON hasil sebelumnya untuk dibandingkan")
+    args = ap.parse_args(argv)
+
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tsbench_")
+    os.makedirs(workdir, exist_ok=True)
+    _isolate_state(workdir)
+    params = {k: v for k, v in vars(args).items() if k not in ("out", "compare", "workdir")}
+    result = {
+        "app_version": ts.APP_VERSION,
+        "cleaner_version": ts.CLEANER_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": params,
+    }
+    try:
+        t0 = time.perf_counter()
+        paths = generate_corpus(
+            os.path.join(workdir, "corpus"), args.count, args.lua_files, args.lua_kb,
+            args.comment_density, args.manifest_files, args.manifest_kb, not args.no_readme, args.seed)
+        result["corpus"] = {"files": len(paths), "mb": round(sum(map(os.path.getsize, paths)) / (1 << 20), 2),
+                            "generate_s": round(time.perf_counter() - t0, 3)}
+        if "stages" not in skip:
+            result["stages"] = bench_stages(paths, workdir)
+        if "profiles" not in skip:
+            result["profiles"] = bench_profiles(paths)
+        if "incremental" not in skip:
+            result["incremental"] = check_incremental(workdir, args.seed)
+        if "batch" not in skip:
+            result["batch"] = bench_batch(paths, workdir, args.workers)
+        if "watcher" not in skip:
+            wpaths = generate_corpus(
+                os.path.join(workdir, "corpus_watch"), args.count, args.lua_files, args.lua_kb,
+                args.comment_density, args.manifest_files, args.manifest_kb, not args.no_readme, args.seed + 1)
+            result["watcher"] = bench_watcher(wpaths, workdir)
+        result["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        ts.get_history().close()
+        ts._history = None
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), result)
+    if not result.get("incremental", {}).get("ok", True):
+        print("FAIL: cek incremental gagal (beda dari repack penuh / hasil tidak berubah ditulis ulang)",
+              file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
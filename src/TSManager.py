@@ -1,44 +1,66 @@
 #!/usr/bin/env python3
 # TSManager.v1.3.0 — LocalSync + Auto-Watch + Log History + Update Checker
 # - Validasi ZIP (harus ada .lua & .manifest)
-# - Clean .lua: hapus full-line comments yang diawali `--`, hapus README*, repack ZIP
+# - Clean .lua: lexer Lua streaming, hapus semua komentar (`--`, `--[[ ]]`, trailing), hapus README*, repack ZIP
 # - Save langsung ke CLEAN_DIR, lalu copy ke DRIVE_DIR (Google Drive Desktop)
 # - Auto-Watch: pantau folder untuk .zip baru; proses otomatis jika valid
-# - Log & History: logs/tsmanager_log.csv + processed_md5.txt
+# - Log & History: logs/tsmanager.db (SQLite; impor/ekspor CSV tsmanager_log.csv)
 # - Update Checker: tombol "Check Update" cek JSON versi terbaru, dapat unduh EXE baru
 
 import os
+import io
+import re
 import sys
 import zipfile
+import zlib
+import struct
 import tempfile
 import shutil
 import threading
 import queue
+import collections
+import itertools
+import contextlib
+import fnmatch
+import concurrent.futures
+import multiprocessing
 import datetime
 import hashlib
 import time
 import csv
-import tkinter as tk
-from tkinter import messagebox, filedialog, Text
-
-# --- optional deps for update checker ---
-try:
-    import requests  # bundled di exe; fallback ke urllib bila tidak ada
-except Exception:
-    requests = None
-import webbrowser
-import urllib.request
+import sqlite3
+import atexit
+import select
+import ctypes
+import ctypes.util
+import json
+import signal
+import argparse
+# tkinter, requests, urllib.request & webbrowser di-import saat dipakai (GUI / update checker)
+# supaya mode CLI/daemon start cepat dan jalan di server tanpa display.
+
+def _import_requests():
+    """requests bundled di exe; None -> fallback ke urllib."""
+    try:
+        import requests
+        return requests
+    except Exception:
+        return None
 
 # ========= VERSION & UPDATE SOURCE =========
 APP_VERSION = "1.3.0"
+CLEANER_VERSION = 2  # naikkan bila hasil cleaning/repack berubah (invalidasi result cache)
 # Ganti dengan URL JSON kamu (host di GitHub Pages / Drive public / server)
 # Format JSON yang di-host:
 # {
 #   "version": "1.3.0",
 #   "changelog": "Tambah Auto-Update, Auto-Watch, Log History",
-#   "url": "https://link-ke-TSManager_v1.3.0.exe"
+#   "url": "https://link-ke-TSManager_v1.3.0.exe",
+#   "sha256": "<sha256 file di url>"
 # }
-UPDATE_JSON_URL = "https://raw.githubusercontent.com/tupaicisauk/TSManager/main/update/latest.json"
+# TSMANAGER_UPDATE_URL (env) menimpa URL ini, mis. server lokal untuk uji update
+UPDATE_JSON_URL = (os.environ.get("TSMANAGER_UPDATE_URL")
+                   or "https://raw.githubusercontent.com/tupaicisauk/TSManager/main/update/latest.json")
 
 # ========= CONFIG & PATHS =========
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -48,33 +70,155 @@ DRIVE_DIR_FILE   = os.path.join(BASE_DIR, "DRIVE_DIR.txt")
 WATCH_DIR_FILE   = os.path.join(BASE_DIR, "WATCH_DIR.txt")  # optional
 
 LOGS_DIR         = os.path.join(BASE_DIR, "logs")
-HISTORY_CSV      = os.path.join(LOGS_DIR, "tsmanager_log.csv")
-PROCESSED_MD5_DB = os.path.join(BASE_DIR, "processed_md5.txt")  # satu md5 per baris
-
-POLL_INTERVAL_S  = 5  # detik — interval Auto-Watch
+HISTORY_DB       = os.path.join(LOGS_DIR, "tsmanager.db")  # SQLite (WAL): history + md5 yang sudah diproses
+HISTORY_CSV      = os.path.join(LOGS_DIR, "tsmanager_log.csv")  # legacy (diimpor sekali) / target export CSV
+PROCESSED_MD5_DB = os.path.join(BASE_DIR, "processed_md5.txt")  # legacy: satu md5 per baris (diimpor sekali)
+HISTORY_BATCH_ROWS = 50   # tulis ke DB per transaksi setiap N baris...
+HISTORY_FLUSH_S    = 1.0  # ...atau paling lambat setiap N detik
+INDEX_DIR        = os.path.join(BASE_DIR, "index")  # index digest CLEAN_DIR / DRIVE_DIR
+RESULT_CACHE_DB  = os.path.join(BASE_DIR, "result_cache.txt")  # MD5 sumber -> hasil clean
+RESULT_CACHE_MAX_ENTRIES = 50000  # LRU
+# Manifest per appid (tabel member_manifest di HISTORY_DB): CRC/size member sumber dari hasil clean terakhir
+# -> versi baru cukup proses member yang berubah
+MEMBER_MANIFEST_MAX_ENTRIES = 50000  # appid terlama (record terakhir) dibuang
+# Copy ke folder tujuan ditulis ke nama sementara lalu di-rename (atomic) -> sync Drive tidak melihat file setengah jadi
+PARTIAL_SUFFIX     = ".tsm-part"
+PARTIAL_MAX_AGE_S  = 3600  # sisa file sementara (crash) lebih tua dari ini dihapus saat folder pertama dipakai
+# Copy Drive yang gagal masuk antrean retry (tabel retry_queue di HISTORY_DB), jeda dobel tiap gagal
+RETRY_BASE_S       = 30
+RETRY_MAX_S        = 3600
+RETRY_MAX_ATTEMPTS = 20  # setelah ini menyerah (tercatat di history)
+# Update checker: manifest + ETag/Last-Modified di-cache (request kondisional), download resume via .part
+UPDATE_CACHE_FILE        = os.path.join(BASE_DIR, "update_cache.json")
+UPDATE_PART_SUFFIX       = ".part"
+UPDATE_CHUNK             = 1 << 16
+UPDATE_DOWNLOAD_ATTEMPTS = 5  # tiap percobaan melanjutkan .part (HTTP Range)
+UPDATE_RETRY_S           = 2  # jeda antar percobaan (x nomor percobaan)
+UPDATE_REQUIRE_SHA256    = True  # latest.json tanpa sha256 valid -> tidak diunduh otomatis (hanya buka di browser)
+# Reconcile CLEAN_DIR -> DRIVE_DIR
+RECONCILE_WORKERS       = 4  # hash / copy paralel (I/O)
+RECONCILE_MTIME_SLACK_S = 2  # size sama & selisih mtime <= ini -> dianggap sama (FAT/Drive membulatkan mtime)
+
+POLL_INTERVAL_S  = 5  # detik — interval Auto-Watch (maksimum saat polling adaptif)
+POLL_MIN_INTERVAL_S = 0.5  # interval polling saat ada aktivitas
+FULL_RESCAN_S    = 60  # polling: scan penuh minimal sekali per interval ini walau mtime folder tetap
+WATCH_BACKEND    = "auto"  # "auto" (inotify bila ada, else polling), "inotify", "poll"
+WATCH_SEEN_DB    = os.path.join(BASE_DIR, "watch_seen.txt")  # (path, size, mtime) yang sudah ditangani
+# Multi-folder Auto-Watch: {"routes": [{"watch_dir", "recursive", "include", "exclude", "clean_dir", "drive_dir"}]}
+# Bila ada, dipakai GUI / daemon menggantikan WATCH_DIR.txt tunggal
+WATCH_ROUTES_FILE = os.path.join(BASE_DIR, "watch_routes.json")
+STABLE_WINDOW_S  = 2.0  # file baru diproses setelah size/mtime tidak berubah selama ini (atau close-write)
+STABLE_GIVEUP_S  = 60  # file diam selama ini tapi belum punya EOCD -> dianggap bukan zip valid
+# Pipeline Auto-Watch: discovery -> validate+hash -> clean/repack -> copy CLEAN_DIR/DRIVE_DIR
+WATCH_HASH_WORKERS  = 2
+WATCH_CLEAN_WORKERS = 2
+WATCH_COPY_WORKERS  = 1  # copy ke Drive; target yang sama tetap serial via _target_lock
+WATCH_QUEUE_SIZE    = 8  # kapasitas tiap antrean antar-tahap (backpressure)
+
+# Cleaner Lua (lexer streaming, per chunk)
+LUA_STRIP_BLANK_LINES = False  # True: baris kosong asli ikut dibuang (baris yang kosong karena komentar selalu dibuang)
+LUA_CLEAN_CHUNK       = 1 << 16  # 64KB per potongan
+
+# Repack streaming: member .lua > batas ini di-spill ke disk saat cleaning (selain itu di RAM)
+STREAM_SPILL_BYTES = 32 << 20  # 32MB — ukuran maksimum satu member di memori
+# Anggaran resource repack: job yang melebihi anggaran menunggu giliran (bukan OOM / disk temp penuh)
+REPACK_TEMP_DIR           = None       # folder tempdir & spill repack (None = temp sistem); arahkan ke disk besar
+BUDGET_TEMP_BYTES         = 2 << 30    # total perkiraan byte temp semua job aktif (termasuk yang menunggu copy)
+BUDGET_TEMP_RESERVE_BYTES = 256 << 20  # ruang kosong yang selalu disisakan di disk temp
+BUDGET_LARGE_JOB_BYTES    = 256 << 20  # perkiraan temp >= ini -> job besar
+BUDGET_MAX_LARGE_JOBS     = 1          # job besar yang boleh jalan bersamaan
+# Member yang tidak berubah (.manifest, .lua tanpa komentar) disalin raw: tanpa decompress/recompress
+REPACK_RAW_PASSTHROUGH = True
+# Repack deterministik: urutan member tersortir, timestamp & atribut dinormalisasi
+# -> sumber yang sama selalu menghasilkan zip (dan MD5) yang sama, tidak ada upload ulang ke Drive
+REPACK_DETERMINISTIC = True
+REPACK_TIMESTAMP     = "source"  # "source" (date_time member asli) atau "fixed" (1980-01-01 00:00)
+
+# Kompresi zip hasil: profil aturan per ekstensi ("*" = lainnya). Aturan: "keep" (salin raw dari sumber bila bisa),
+# "store", "deflate:N", "bzip2:N", "lzma". Member yang sudah memakai metode target tidak dikompres ulang.
+COMPRESS_PROFILE  = "balanced"
+COMPRESS_PROFILES = {
+    "fast":     {".lua": "deflate:1", "*": "keep"},
+    "balanced": {".lua": "deflate:6", "*": "keep"},
+    "smallest": {".lua": "lzma", ".manifest": "deflate:9", "*": "deflate:9"},
+}
+COMPRESS_ALLOW_LZMA  = False     # LZMA/BZIP2 tidak dibuka Explorer Windows -> False: diganti deflate:9
+COMPRESS_MIN_BYTES   = 128       # member lebih kecil -> store (header deflate tidak sepadan)
+COMPRESS_PROBE_BYTES = 64 << 10  # probe entropi: sample awal member dikompres cepat ...
+COMPRESS_PROBE_RATIO = 0.97      # ... bila hasilnya >= 97% ukuran sample -> store
+
+# Inspeksi arsip (central directory saja) + batas anti zip-bomb (ukuran dari central directory)
+ZIP_VERIFY_CRC       = True       # CRC member yang di-decompress (.lua) dicek saat streaming, tanpa pass terpisah
+ZIP_VERIFY_RAW_CRC   = True       # member raw passthrough (STORED/DEFLATED) di-inflate & dibuang sambil disalin untuk cek CRC
+ZIP_MAX_MEMBERS      = 10000
+ZIP_MAX_TOTAL_BYTES  = 4 << 30    # total ukuran asli semua member
+ZIP_MAX_RATIO        = 200        # rasio asli/terkompresi per member ...
+ZIP_RATIO_MIN_BYTES  = 16 << 20   # ... hanya dicek untuk member >= ukuran ini
+_FIXED_DATE_TIME     = (1980, 1, 1, 0, 0, 0)
+
+# Batch paralel (manual Run): 0 = otomatis (jumlah core), 1 = serial
+BATCH_WORKERS    = 0
+BATCH_POOL       = "process"  # "process" (CPU-bound, lintas core) atau "thread"
+
+# Instrumentasi per tahap (kolom history + panel throughput). False = tanpa timing, overhead ~nol
+METRICS_ENABLED       = True
+METRICS_WINDOW        = 500  # p50/p95 dari N file terakhir
+METRICS_RATE_WINDOW_S = 60   # files/min & MB/s dari file yang selesai dalam N detik terakhir
+
+# Log panel GUI
+UILOG_MAX_LINES          = 5000  # ring: baris lama dibuang dari widget
+UILOG_PROGRESS_INTERVAL_S = 0.5  # pesan progress (download %, dll) maksimal 1x per interval per key
 
 # ========= UI LOGGER =========
-class UILogger:
-    def __init__(self, root: tk.Tk, text_widget: Text):
+class _ProgressLimiter:
+    """progress(key, msg): pesan progress per key di-throttle (UILOG_PROGRESS_INTERVAL_S); final selalu lolos."""
+
+    def progress(self, key, msg: str, final=False):
+        now = time.monotonic()
+        with self._progress_lock:
+            last = self._progress_last.get(key)
+            if not final and last is not None and now - last < UILOG_PROGRESS_INTERVAL_S:
+                return
+            if final:
+                self._progress_last.pop(key, None)
+            else:
+                self._progress_last[key] = now
+        self.log(msg)
+
+class UILogger(_ProgressLimiter):
+    def __init__(self, root: "tk.Tk", text_widget: "tk.Text", max_lines=None):
         self.root = root
         self.text = text_widget
         self.q = queue.Queue()
+        self.max_lines = max_lines or UILOG_MAX_LINES
+        self._progress_lock = threading.Lock()
+        self._progress_last = {}
         self.text.configure(state="disabled")
 
     def log(self, msg: str):
-        self.q.put(msg)
+        self.q.put(f"{datetime.datetime.now().strftime('%H:%M:%S')}  {msg}\n")
 
     def _drain(self):
+        """Semua pesan tertunda -> satu insert per tick; widget dipangkas ke max_lines baris."""
+        lines = []
         try:
             while True:
-                msg = self.q.get_nowait()
-                self.text.configure(state="normal")
-                timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-                self.text.insert("end", f"{timestamp}  {msg}\n")
-                self.text.see("end")
-                self.text.configure(state="disabled")
+                lines.append(self.q.get_nowait())
         except queue.Empty:
             pass
+        if not lines:
+            return
+        skipped = len(lines) - self.max_lines
+        if skipped > 0:
+            lines = lines[skipped:]
+            lines.insert(0, f"{datetime.datetime.now().strftime('%H:%M:%S')}  … {skipped} baris log dilewati\n")
+        self.text.configure(state="normal")
+        self.text.insert("end", "".join(lines))
+        excess = int(self.text.index("end-1c").split(".")[0]) - 1 - self.max_lines
+        if excess > 0:
+            self.text.delete("1.0", f"{excess + 1}.0")
+        self.text.see("end")
+        self.text.configure(state="disabled")
 
     def schedule(self, interval_ms: int = 200):
         self._drain()
@@ -83,6 +227,33 @@ class UILogger:
     def call_ui(self, fn, *args, **kwargs):
         self.root.after(0, lambda: fn(*args, **kwargs))
 
+    def alert(self, title, msg):
+        from tkinter import messagebox
+        messagebox.showerror(title, msg)
+
+class ConsoleLogger(_ProgressLimiter):
+    """Pengganti UILogger untuk CLI/daemon: log ke stdout, teks biasa atau JSON per baris."""
+
+    def __init__(self, json_mode=False, stream=None):
+        self.json_mode = json_mode
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+        self._progress_lock = threading.Lock()
+        self._progress_last = {}
+
+    def log(self, msg: str):
+        now = datetime.datetime.now()
+        if self.json_mode:
+            line = json.dumps({"ts": now.isoformat(timespec="milliseconds"), "msg": msg}, ensure_ascii=False)
+        else:
+            line = f"{now.strftime('%H:%M:%S')}  {msg}"
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def alert(self, title, msg):
+        self.log(f"❌ {title}: {msg}")
+
 # ========= HELPERS =========
 def _ensure_dir(p):
     os.makedirs(p, exist_ok=True)
@@ -100,6 +271,7 @@ def _write_path(pathfile, value):
         f.write(value)
 
 def _pick_and_save_dir(title, pathfile):
+    from tkinter import filedialog
     sel = filedialog.askdirectory(title=title, mustexist=True)
     if sel:
         _write_path(pathfile, sel)
@@ -121,132 +293,1802 @@ def md5_file(path):
             h.update(chunk)
     return h.hexdigest()
 
-def copy_auto_replace(src, dst):
-    """Copy src->dst: skip if identical MD5, else replace."""
-    if os.path.exists(dst):
+def _stat_key(path, st=None):
+    st = st or os.stat(path)
+    return (os.path.normcase(os.path.abspath(path)), st.st_size, st.st_mtime_ns, st.st_ino)
+
+class DigestCache:
+    """
+    Cache MD5 per run, key (path, size, mtime_ns, inode).
+    Dipakai bersama oleh watcher, prepare/deliver dan copy_auto_replace -> tiap byte dibaca maks. sekali.
+    """
+    MAX_ENTRIES = 20000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._d = collections.OrderedDict()  # key -> [md5, valid_manifest or None, reason]
+
+    def _get(self, key):
+        with self._lock:
+            ent = self._d.get(key)
+            if ent is not None:
+                self._d.move_to_end(key)
+            return ent
+
+    def put_key(self, key, digest, valid=None, reason=""):
+        with self._lock:
+            ent = self._d.get(key)
+            if ent is None:
+                self._d[key] = [digest, valid, reason]
+                if len(self._d) > self.MAX_ENTRIES:
+                    self._d.popitem(last=False)
+            else:
+                ent[0] = digest
+                if valid is not None:
+                    ent[1], ent[2] = valid, reason
+
+    def get(self, path, st=None):
+        """MD5 dari cache saja (None bila belum pernah dihitung)."""
+        ent = self._get(_stat_key(path, st))
+        return ent[0] if ent is not None else None
+
+    def put(self, path, digest, st=None):
+        self.put_key(_stat_key(path, st), digest)
+
+    def md5(self, path, st=None):
+        key = _stat_key(path, st)
+        ent = self._get(key)
+        if ent is not None:
+            return ent[0]
+        digest = md5_file(path)
+        self.put_key(key, digest)
+        return digest
+
+    def inspect_zip(self, path, st=None):
+        """
+        Return (md5, valid_manifest, reason, ZipInspection | None); bila belum ada, hash & inspeksi
+        dari satu kali baca. Inspection None bila verdict sudah ada di cache (file tidak dibaca ulang).
+        """
+        key = _stat_key(path, st)
+        ent = self._get(key)
+        if ent is not None and ent[1] is not None:
+            return ent[0], ent[1], ent[2], None
+        if ent is not None:
+            insp = inspect_archive(path)  # md5 sudah ada: cukup baca central directory
+            digest = ent[0]
+        else:
+            digest, insp = md5_and_validate_zip(path)
+        self.put_key(key, digest, insp.valid, insp.reason)
+        return digest, insp.valid, insp.reason, insp
+
+_target_locks = {}
+_target_locks_guard = threading.Lock()
+
+def _target_lock(dst):
+    """Lock per file tujuan: copy ke target yang sama selalu serial (batch + Auto-Watch)."""
+    key = os.path.normcase(os.path.abspath(dst))
+    with _target_locks_guard:
+        lock = _target_locks.get(key)
+        if lock is None:
+            lock = _target_locks[key] = threading.Lock()
+        return lock
+
+def _indexed_md5(path, st, digests, index=None):
+    """MD5 dari index folder (size+mtime cocok -> tanpa baca isi), lalu DigestCache, terakhir baca file."""
+    name = os.path.basename(path)
+    if index is not None:
+        digest = index.lookup(name, st)
+        if digest:
+            digests.put(path, digest, st)
+            return digest
+    digest = digests.md5(path, st)
+    if index is not None:
+        index.record(name, st, digest)
+    return digest
+
+def _atomic_copy(src, dst):
+    """Copy ke nama sementara di folder tujuan, fsync, lalu os.replace ke nama final."""
+    folder, name = os.path.split(dst)
+    tmp = os.path.join(folder, f".{name}.{os.getpid()}-{threading.get_ident()}{PARTIAL_SUFFIX}")
+    try:
+        shutil.copyfile(src, tmp)
+        shutil.copystat(src, tmp)
+        with open(tmp, "r+b") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, dst)
+    except BaseException:
         try:
-            if md5_file(src) == md5_file(dst):
-                return "exists-identical"
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def cleanup_partial_copies(directory, max_age_s=None):
+    """Hapus file sementara sisa copy yang terputus (crash / listrik mati). Return jumlah file."""
+    max_age_s = PARTIAL_MAX_AGE_S if max_age_s is None else max_age_s
+    limit = time.time() - max_age_s
+    n = 0
+    try:
+        for entry in os.scandir(directory):
+            if entry.name.startswith(".") and entry.name.endswith(PARTIAL_SUFFIX):
+                try:
+                    if entry.stat().st_mtime < limit:
+                        os.remove(entry.path)
+                        n += 1
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return n
+
+def copy_auto_replace(src, dst, digests=None):
+    """Copy src->dst: skip if identical MD5, else replace. Digest dst diambil dari index folder tujuan."""
+    digests = digests or DigestCache()
+    dst_index = get_dir_index(os.path.dirname(dst))
+    src_index = find_dir_index(os.path.dirname(src))
+    with _target_lock(dst):
+        if os.path.exists(dst):
+            try:
+                src_st, dst_st = os.stat(src), os.stat(dst)
+                # ukuran beda -> pasti beda, tidak perlu hash
+                if src_st.st_size == dst_st.st_size and \
+                        _indexed_md5(src, src_st, digests, src_index) == _indexed_md5(dst, dst_st, digests, dst_index):
+                    return "exists-identical"
+            except Exception:
+                pass
+        _ensure_dir(os.path.dirname(dst))
+        _atomic_copy(src, dst)
+        # isi dst == src: catat digest-nya di cache & index supaya dst tidak perlu dibaca ulang
+        try:
+            src_md5 = _indexed_md5(src, os.stat(src), digests, src_index)
+            dst_st = os.stat(dst)
+            digests.put(dst, src_md5, dst_st)
+            dst_index.record(os.path.basename(dst), dst_st, src_md5)
         except Exception:
             pass
-    _ensure_dir(os.path.dirname(dst))
-    shutil.copy2(src, dst)
-    return "copied"
+        return "copied"
 
-# ========= HISTORY / LOGGING =========
-def ensure_log_headers():
-    _ensure_dir(LOGS_DIR)
-    if not os.path.exists(HISTORY_CSV):
-        with open(HISTORY_CSV, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "timestamp", "version", "action", "src_zip", "appid", "result",
-                "zip_md5", "clean_target", "drive_target", "notes"
-            ])
-
-def append_log(action, src_zip, appid, result, zip_md5, clean_target, drive_target, notes):
-    ensure_log_headers()
-    with open(HISTORY_CSV, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            datetime.datetime.now().isoformat(timespec="seconds"),
-            APP_VERSION,
-            action, src_zip, appid, result,
-            zip_md5 or "", clean_target or "", drive_target or "", notes or ""
-        ])
-
-def load_processed_md5():
-    s = set()
-    if os.path.exists(PROCESSED_MD5_DB):
-        with open(PROCESSED_MD5_DB, "r", encoding="utf-8") as f:
+# ========= DIGEST INDEX (CLEAN_DIR / DRIVE_DIR) =========
+class DirIndex:
+    """
+    Index digest persisten per folder: nama file -> (size, mtime_ns, md5).
+    Diperbarui setiap TSManager menulis ke folder itu; keputusan "identical" cukup cek size/mtime
+    tanpa membaca isi file (penting untuk folder streaming Google Drive Desktop).
+    Disimpan di INDEX_DIR (bukan di dalam folder) supaya tidak ikut tersinkron ke Drive.
+    Format: append-only, satu baris "name<TAB>size<TAB>mtime_ns<TAB>md5", baris terakhir menang.
+    """
+
+    def __init__(self, directory):
+        self.dir = os.path.abspath(directory)
+        tag = hashlib.md5(os.path.normcase(self.dir).encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(INDEX_DIR, f"{tag}.idx")
+        self._lock = threading.Lock()
+        self._d = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        n_lines = 0
+        with open(self.path, "r", encoding="utf-8") as f:
             for line in f:
-                md5 = line.strip()
-                if md5:
-                    s.add(md5)
-    return s
+                if line.startswith("#"):
+                    continue
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 4:
+                    continue
+                n_lines += 1
+                try:
+                    self._d[parts[0]] = (int(parts[1]), int(parts[2]), parts[3])
+                except ValueError:
+                    continue
+        if n_lines > 2 * len(self._d) + 100:
+            self._save()  # compact: buang baris lama yang sudah ditimpa
+
+    def _save(self):
+        _ensure_dir(INDEX_DIR)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(f"# {self.dir}\n")
+            for name, (size, mtime_ns, digest) in self._d.items():
+                f.write(f"{name}\t{size}\t{mtime_ns}\t{digest}\n")
+        os.replace(tmp, self.path)
+
+    def lookup(self, name, st):
+        """MD5 bila entry index masih cocok dengan size & mtime file (hanya dari stat)."""
+        with self._lock:
+            ent = self._d.get(name)
+        if ent and ent[0] == st.st_size and ent[1] == st.st_mtime_ns:
+            return ent[2]
+        return None
+
+    def record(self, name, st, digest):
+        ent = (st.st_size, st.st_mtime_ns, digest)
+        with self._lock:
+            if self._d.get(name) == ent:
+                return
+            self._d[name] = ent
+            _ensure_dir(INDEX_DIR)
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", encoding="utf-8") as f:
+                if new_file:
+                    f.write(f"# {self.dir}\n")
+                f.write(f"{name}\t{ent[0]}\t{ent[1]}\t{digest}\n")
+
+    def rebuild(self, ui=None):
+        """Walk folder sekali, hash semua .zip, tulis ulang index. Return jumlah file."""
+        fresh = {}
+        for entry in os.scandir(self.dir):
+            if not entry.is_file() or not entry.name.lower().endswith(".zip"):
+                continue
+            try:
+                st = entry.stat()
+                fresh[entry.name] = (st.st_size, st.st_mtime_ns, md5_file(entry.path))
+            except Exception as e:
+                if ui:
+                    ui.log(f"⚠️ Index skip {entry.name}: {e}")
+        with self._lock:
+            self._d = fresh
+            self._save()
+        return len(fresh)
+
+_dir_indexes = {}
+_dir_indexes_guard = threading.Lock()
+
+def get_dir_index(directory):
+    key = os.path.normcase(os.path.abspath(directory))
+    with _dir_indexes_guard:
+        idx = _dir_indexes.get(key)
+        if idx is None:
+            idx = _dir_indexes[key] = DirIndex(directory)
+            cleanup_partial_copies(directory)  # sekali per folder per proses
+        return idx
+
+def find_dir_index(directory):
+    """Index yang sudah dibuka untuk folder ini, atau None (mis. tempdir hasil repack)."""
+    with _dir_indexes_guard:
+        return _dir_indexes.get(os.path.normcase(os.path.abspath(directory)))
+
+def rebuild_indexes_run(ui: UILogger):
+    try:
+        clean_dir = ensure_config_dir(CLEAN_DIR_FILE, "Pilih folder hasil cleaning (CLEAN_DIR)")
+        drive_dir = ensure_config_dir(DRIVE_DIR_FILE, "Pilih folder Google Drive Desktop tujuan (DRIVE_DIR)")
+        for d in (clean_dir, drive_dir):
+            ui.log(f"🧮 Rebuild index: {d}")
+            n = get_dir_index(d).rebuild(ui)
+            ui.log(f"✅ Index selesai: {n} file")
+    except Exception as e:
+        ui.log(f"❌ Rebuild index gagal: {e}")
+
+# ========= HISTORY / LOGGING =========
+HISTORY_COLUMNS = [
+    "timestamp", "version", "action", "src_zip", "appid", "result",
+    "zip_md5", "clean_target", "drive_target", "notes"
+]
+# Instrumentasi: ms per tahap + byte masuk/keluar (NULL bila METRICS_ENABLED mati / tahap dilewati)
+STAGE_NAMES = ("inspect", "clean", "repack", "copy_clean", "copy_drive")
+METRIC_COLUMNS = [f"{s}_ms" for s in STAGE_NAMES] + ["total_ms", "bytes_in", "bytes_out",
+                                                     "budget_wait_ms", "peak_temp_bytes", "peak_mem_bytes"]
+_ALL_HISTORY_COLUMNS = HISTORY_COLUMNS + METRIC_COLUMNS
+
+class HistoryStore:
+    """
+    History + daftar MD5 yang sudah diproses dalam satu SQLite (WAL).
+    Baris ditampung lalu ditulis per transaksi (HISTORY_BATCH_ROWS / HISTORY_FLUSH_S);
+    lookup per MD5 / appid / tanggal lewat index, tanpa memuat semuanya ke memori.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        _ensure_dir(os.path.dirname(path))
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        cols = ", ".join(f"{c} TEXT" for c in HISTORY_COLUMNS[1:])
+        with self._conn:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS history ("
+                               f"id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, {cols})")
+            # DB lama (sebelum instrumentasi) -> tambah kolom metrik
+            have = {r[1] for r in self._conn.execute("PRAGMA table_info(history)")}
+            for c in METRIC_COLUMNS:
+                if c not in have:
+                    kind = "INTEGER" if "bytes" in c else "REAL"
+                    self._conn.execute(f"ALTER TABLE history ADD COLUMN {c} {kind}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_history_md5 ON history(zip_md5)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_history_appid ON history(appid)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_history_ts ON history(timestamp)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS processed ("
+                               "md5 TEXT PRIMARY KEY, first_seen TEXT) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._rows = []
+        self._md5s = {}  # md5 -> first_seen, belum di-flush
+        self._last_flush = time.monotonic()
+        self._flusher = None
+
+    # --- tulis (buffered) ---
+    def add_history(self, row):
+        if len(row) < len(_ALL_HISTORY_COLUMNS):
+            row = list(row) + [None] * (len(_ALL_HISTORY_COLUMNS) - len(row))
+        with self._lock:
+            self._rows.append(row)
+            self._maybe_flush()
+
+    def add_processed(self, md5):
+        if not md5:
+            return
+        with self._lock:
+            self._md5s.setdefault(md5, datetime.datetime.now().isoformat(timespec="seconds"))
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        pending = len(self._rows) + len(self._md5s)
+        if pending >= HISTORY_BATCH_ROWS or time.monotonic() - self._last_flush >= HISTORY_FLUSH_S:
+            self.flush()
+        elif self._flusher is None:
+            # flush sisa buffer walau tidak ada baris baru yang menyusul
+            self._flusher = threading.Timer(HISTORY_FLUSH_S, self._timed_flush)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._flusher = None
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._rows and not self._md5s:
+                return
+            rows, md5s = self._rows, self._md5s
+            self._rows, self._md5s = [], {}
+            marks = ", ".join("?" * len(_ALL_HISTORY_COLUMNS))
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT INTO history ({', '.join(_ALL_HISTORY_COLUMNS)}) VALUES ({marks})", rows)
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed (md5, first_seen) VALUES (?, ?)", md5s.items())
+
+    # --- baca ---
+    def is_processed(self, md5):
+        with self._lock:
+            if md5 in self._md5s:
+                return True
+            cur = self._conn.execute("SELECT 1 FROM processed WHERE md5 = ?", (md5,))
+            return cur.fetchone() is not None
+
+    def query(self, md5=None, appid=None, date=None, limit=1000):
+        """Cari history per MD5 / appid / tanggal (YYYY-MM-DD). Return list dict, terbaru dulu."""
+        self.flush()
+        where, args = [], []
+        if md5:
+            where.append("zip_md5 = ?")
+            args.append(md5)
+        if appid:
+            where.append("appid = ?")
+            args.append(appid)
+        if date:
+            # rentang string ISO -> tetap memakai index timestamp
+            where.append("timestamp >= ? AND timestamp < ?")
+            args += [date, date + "~"]
+        sql = f"SELECT {', '.join(_ALL_HISTORY_COLUMNS)} FROM history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            cur = self._conn.execute(sql, args + [limit])
+            return [dict(zip(_ALL_HISTORY_COLUMNS, r)) for r in cur.fetchall()]
+
+    def stage_rows(self, limit=METRICS_WINDOW):
+        """N baris terakhir yang punya metrik tahap, terlama dulu: list (timestamp, dict metrik)."""
+        self.flush()
+        with self._lock:
+            cur = self._conn.execute(
+                f"SELECT timestamp, {', '.join(METRIC_COLUMNS)} FROM history "
+                f"WHERE total_ms IS NOT NULL ORDER BY id DESC LIMIT ?", (limit,))
+            rows = cur.fetchall()
+        return [(r[0], dict(zip(METRIC_COLUMNS, r[1:]))) for r in reversed(rows)]
+
+    # --- impor / ekspor ---
+    def import_legacy(self, csv_path, md5_path):
+        """Impor tsmanager_log.csv + processed_md5.txt lama (sekali saja). Return (n_rows, n_md5)."""
+        with self._lock:
+            self.flush()
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+                return 0, 0
+            n_rows = n_md5 = 0
+            with self._conn:
+                if os.path.exists(csv_path):
+                    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+                        rows = [[r.get(c) or "" for c in HISTORY_COLUMNS] for r in csv.DictReader(f)]
+                    marks = ", ".join("?" * len(HISTORY_COLUMNS))
+                    self._conn.executemany(
+                        f"INSERT INTO history ({', '.join(HISTORY_COLUMNS)}) VALUES ({marks})", rows)
+                    n_rows = len(rows)
+                if os.path.exists(md5_path):
+                    with open(md5_path, "r", encoding="utf-8") as f:
+                        md5s = {line.strip() for line in f if line.strip()}
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO processed (md5, first_seen) VALUES (?, '')",
+                        ((m,) for m in md5s))
+                    n_md5 = len(md5s)
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', ?)",
+                                   (datetime.datetime.now().isoformat(timespec="seconds"),))
+            return n_rows, n_md5
+
+    def export_csv(self, csv_path):
+        """Tulis seluruh history ke CSV (kolom tsmanager_log.csv lama + kolom metrik di belakang)."""
+        with self._lock:
+            self.flush()
+            _ensure_dir(os.path.dirname(csv_path))
+            tmp = csv_path + ".tmp"
+            n = 0
+            with open(tmp, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(_ALL_HISTORY_COLUMNS)
+                for row in self._conn.execute(f"SELECT {', '.join(_ALL_HISTORY_COLUMNS)} FROM history ORDER BY id"):
+                    writer.writerow(["" if v is None else v for v in row])
+                    n += 1
+            os.replace(tmp, csv_path)
+            return n
+
+    def close(self):
+        with self._lock:
+            if self._flusher is not None:
+                self._flusher.cancel()
+                self._flusher = None
+            self.flush()
+            self._conn.close()
+
+_history = None
+_history_guard = threading.Lock()
+
+def get_history():
+    """HistoryStore global; saat pertama dibuka, history CSV/txt lama diimpor otomatis."""
+    global _history
+    with _history_guard:
+        if _history is None:
+            _history = HistoryStore(HISTORY_DB)
+            _history.import_legacy(HISTORY_CSV, PROCESSED_MD5_DB)
+            atexit.register(_history.flush)
+        return _history
+
+def append_log(action, src_zip, appid, result, zip_md5, clean_target, drive_target, notes, metrics=None):
+    row = [
+        datetime.datetime.now().isoformat(timespec="seconds"),
+        APP_VERSION,
+        action, src_zip, appid, result,
+        zip_md5 or "", clean_target or "", drive_target or "", notes or ""
+    ]
+    if metrics:
+        row += [metrics.get(c) for c in METRIC_COLUMNS]
+    get_history().add_history(row)
+
+def is_processed_md5(val):
+    return get_history().is_processed(val)
 
 def add_processed_md5(val):
-    with open(PROCESSED_MD5_DB, "a", encoding="utf-8") as f:
-        f.write(val + "\n")
+    get_history().add_processed(val)
+
+def export_history_run(ui: UILogger, csv_path=None):
+    try:
+        csv_path = csv_path or HISTORY_CSV
+        n = get_history().export_csv(csv_path)
+        ui.log(f"📤 History diekspor: {csv_path} ({n} baris)")
+    except Exception as e:
+        ui.log(f"❌ Export history gagal: {e}")
+
+# ========= STAGE METRICS =========
+def _percentiles(values):
+    vals = sorted(values)
+    n = len(vals)
+    rank = lambda q: vals[min(n - 1, max(0, -(-n * q // 100) - 1))]  # nearest-rank
+    return {"n": n, "p50": round(rank(50), 1), "p95": round(rank(95), 1)}
+
+class StageStats:
+    """Agregat bergulir: p50/p95 ms per tahap (METRICS_WINDOW file terakhir), files/min & MB/s."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._ms = {s: collections.deque(maxlen=window) for s in STAGE_NAMES + ("total",)}
+        self._done = collections.deque(maxlen=window)  # (t_selesai, t_mulai, bytes_in)
+        self._compression = {}  # profil -> Counter(files, raw, out, cpu_ms), kumulatif sesi
+        self.files = 0
+
+    def record_compression(self, zstats):
+        with self._lock:
+            c = self._compression.setdefault(zstats["profile"], collections.Counter())
+            c["files"] += 1
+            c["raw"] += zstats.get("raw", 0)
+            c["out"] += zstats.get("out", 0)
+            c["cpu_ms"] += zstats.get("cpu_ms", 0.0)
+
+    def compression(self):
+        """Salinan total kompresi per profil (untuk selisih per run)."""
+        with self._lock:
+            return {p: collections.Counter(c) for p, c in self._compression.items()}
+
+    def record(self, metrics, when=None):
+        when = time.time() if when is None else when
+        total = metrics.get("total_ms") or 0.0
+        with self._lock:
+            for s in STAGE_NAMES:
+                v = metrics.get(f"{s}_ms")
+                if v is not None:
+                    self._ms[s].append(v)
+            self._ms["total"].append(total)
+            self._done.append((when, when - total / 1000.0, metrics.get("bytes_in") or 0))
+            self.files += 1
+
+    def snapshot(self, now=None, window_s=METRICS_RATE_WINDOW_S):
+        """window_s=None: throughput dihitung dari seluruh isi window (mis. data dari history DB)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            stages = {s: _percentiles(d) for s, d in self._ms.items() if d}
+            done = list(self._done)
+        if window_s:
+            done = [d for d in done if d[0] >= now - window_s]
+        fpm = mbps = 0.0
+        if done:
+            start = min(d[1] for d in done)
+            if window_s:
+                start = max(start, now - window_s)
+            span = max(now - start, 1.0)  # timestamp history beresolusi detik
+            fpm = len(done) * 60.0 / span
+            mbps = sum(d[2] for d in done) / (1 << 20) / span
+        return {"files": self.files, "files_per_min": round(fpm, 1), "mb_per_s": round(mbps, 2),
+                "stages": stages, "compression": self.compression()}
+
+def format_stage_stats(snap):
+    """Ringkasan snapshot StageStats: list baris teks (panel GUI / CLI stats)."""
+    lines = [f"⏱ {snap['files']} file • {snap['files_per_min']:.1f} file/min • {snap['mb_per_s']:.2f} MB/s"]
+    parts = [f"{s} {v['p50']:.0f}/{v['p95']:.0f}" for s, v in snap["stages"].items()]
+    if parts:
+        lines.append("p50/p95 ms: " + " • ".join(parts))
+    lines.extend(format_compression(snap.get("compression") or {}))
+    return lines
+
+def format_compression(comp):
+    """Baris ringkasan kompresi per profil: byte asli -> terkompresi, hemat, CPU repack."""
+    lines = []
+    for profile, c in sorted(comp.items()):
+        if not c.get("files"):
+            continue
+        raw, out = c["raw"], c["out"]
+        saved = raw - out
+        pct = abs(saved) * 100.0 / raw if raw else 0.0
+        # hasil bisa sedikit lebih besar (header / member store) -> tampilkan tanpa tanda minus
+        label = "hemat" if saved >= 0 else "bertambah"
+        lines.append(f"🗜 {profile}: {c['files']} file • {raw / (1 << 20):.1f} → {out / (1 << 20):.1f} MB "
+                     f"({label} {abs(saved) / (1 << 20):.1f} MB, {pct:.0f}%) • CPU {c['cpu_ms'] / 1000.0:.1f} s")
+    return lines
+
+_stage_stats = None
+_stage_stats_guard = threading.Lock()
+
+def get_stage_stats():
+    """StageStats sesi ini (diisi deliver_zip)."""
+    global _stage_stats
+    with _stage_stats_guard:
+        if _stage_stats is None:
+            _stage_stats = StageStats()
+        return _stage_stats
+
+def stage_stats_from_history(limit=METRICS_WINDOW):
+    """Snapshot dari N baris terakhir history DB (untuk `stats` CLI / setelah restart)."""
+    rows = get_history().stage_rows(limit)
+    stats = StageStats(window=max(limit, 1))
+    when = None
+    for ts, metrics in rows:
+        try:
+            when = datetime.datetime.fromisoformat(ts).timestamp()
+        except (TypeError, ValueError):
+            continue
+        stats.record(metrics, when)
+    return stats.snapshot(now=when, window_s=None)
 
 # ========= ZIP VALIDATION & CLEANER =========
-def is_valid_manifest_zip(zip_path):
+def _is_manifest_names(names):
+    has_lua = any(n.lower().endswith(".lua") for n in names)
+    has_manifest = any(n.lower().endswith(".manifest") for n in names)
+    return has_lua and has_manifest
+
+class CorruptZipError(zipfile.BadZipFile):
+    """Member arsip rusak (CRC salah, data terpotong, header lokal salah); pesan menyebut nama member."""
+
+class ZipInspection:
+    """
+    Hasil satu kali baca central directory: member (nama aman -> ZipInfo, lengkap dengan size & CRC),
+    total ukuran dan verdict. Dipakai ulang oleh process_zip_to_cleaned -> central directory tidak diparse lagi.
+    error: arsip rusak / melewati batas zip-bomb (tidak boleh diproses); reason: alasan verdict invalid.
+    """
+
+    def __init__(self, infos, size=0, mtime_ns=0, error=None):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.names = [info.filename for info in infos]
+        # extractall: member dengan nama sama ditimpa yang terakhir
+        self.members = {}
+        for info in infos:
+            arc = _safe_arcname(info.filename)
+            if arc and not info.is_dir():
+                self.members[arc] = info
+        self.total_size = sum(info.file_size for info in infos)
+        self.total_compressed = sum(info.compress_size for info in infos)
+        self.error = error or self._limits(infos)
+        self.valid = self.error is None and _is_manifest_names(self.names)
+        self.reason = "" if self.valid else (self.error or "no .lua/.manifest")
+
+    def _limits(self, infos):
+        if len(infos) > ZIP_MAX_MEMBERS:
+            return f"zip-bomb: {len(infos)} member (maks {ZIP_MAX_MEMBERS})"
+        if self.total_size > ZIP_MAX_TOTAL_BYTES:
+            return f"zip-bomb: total {self.total_size >> 20} MB (maks {ZIP_MAX_TOTAL_BYTES >> 20} MB)"
+        for info in infos:
+            if info.file_size >= ZIP_RATIO_MIN_BYTES and \
+                    info.file_size > max(info.compress_size, 1) * ZIP_MAX_RATIO:
+                return f"zip-bomb: {info.filename} rasio {info.file_size // max(info.compress_size, 1)}:1"
+        return None
+
+    def matches(self, st):
+        return self.size == st.st_size and self.mtime_ns == st.st_mtime_ns
+
+def inspect_archive(zip_path):
+    """Inspeksi dari central directory saja (data member tidak dibaca). Zip rusak -> inspection dengan error."""
     try:
+        st = os.stat(zip_path)
         with zipfile.ZipFile(zip_path, "r") as z:
-            names = z.namelist()
-            has_lua = any(n.lower().endswith(".lua") for n in names)
-            has_manifest = any(n.lower().endswith(".manifest") for n in names)
-            return has_lua and has_manifest
-    except Exception:
+            return ZipInspection(z.infolist(), st.st_size, st.st_mtime_ns)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError, EOFError, ValueError) as e:
+        return ZipInspection([], error=f"bad zip: {e}")
+
+def _inspection_from_tail(tail, st):
+    """Inspeksi dari ekor file di memori; offset header member dikoreksi ke posisi di file asli."""
+    with zipfile.ZipFile(io.BytesIO(tail), "r") as z:
+        infos = z.infolist()
+    base = st.st_size - len(tail)
+    for info in infos:
+        info.header_offset += base
+    return ZipInspection(infos, st.st_size, st.st_mtime_ns)
+
+def has_zip_eocd(zip_path, size=None):
+    """
+    Cek murah: apakah ekor file berisi End Of Central Directory yang utuh?
+    Zip yang masih di-download/di-copy biasanya belum punya EOCD -> jangan di-hash dulu.
+    """
+    try:
+        size = os.path.getsize(zip_path) if size is None else size
+        if size < zipfile.sizeEndCentDir:
+            return False
+        n = min(size, zipfile.sizeEndCentDir + 0xFFFF)  # EOCD + komentar maksimum
+        with open(zip_path, "rb") as f:
+            f.seek(size - n)
+            tail = f.read(n)
+        pos = tail.rfind(zipfile.stringEndArchive)
+        while pos >= 0:
+            if pos + zipfile.sizeEndCentDir <= len(tail):
+                comment_len = struct.unpack("<H", tail[pos + 20:pos + 22])[0]
+                if pos + zipfile.sizeEndCentDir + comment_len == len(tail):
+                    return True
+            pos = tail.rfind(zipfile.stringEndArchive, 0, pos)
+        return False
+    except OSError:
         return False
 
-def clean_lua_file(file_path: str):
-    """Hapus baris yang diawali '--' (full-line comments)."""
+def md5_and_validate_zip(zip_path):
+    """
+    MD5 + inspeksi arsip dari satu kali baca file.
+    Central directory diparse dari ekor file yang masih di memori (2 chunk terakhir);
+    bila tidak muat (CD sangat besar), fallback ke inspect_archive (hanya baca CD).
+    Return (md5, ZipInspection)
+    """
+    h = hashlib.md5()
+    prev = last = b""
+    with open(zip_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        for chunk in iter(lambda: f.read(1 << 20), b""):  # 1MB
+            h.update(chunk)
+            prev, last = last, chunk
     try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.readlines()
-        cleaned = [ln for ln in lines if not ln.lstrip().startswith("--")]
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.writelines(cleaned)
+        # ZipFile menghitung offset CD relatif terhadap EOCD, jadi ekor file cukup untuk infolist()
+        insp = _inspection_from_tail(prev + last, st)
     except Exception:
-        pass
+        insp = inspect_archive(zip_path)
+    return h.hexdigest(), insp
+
+_LUA_TOKEN     = re.compile(rb"--|[\"'\n]|\[=*\[")
+_LUA_LONG_OPEN = re.compile(rb"\[(=*)\[")
+_LUA_STR_BODY  = {
+    b'"': re.compile(rb'(?:[^"\\\n]|(\\z\s*)|\\[\s\S])*'),
+    b"'": re.compile(rb"(?:[^'\\\n]|(\\z\s*)|\\[\s\S])*"),
+}
+_LUA_SPACE     = re.compile(rb"\s*")
+_LUA_LINE_COMMENT = re.compile(rb"\n[ \t\r\f\v]*--[^\n]*")  # dipakai dengan "\n" di depan teks
+_LUA_BLOCK_LINE   = re.compile(rb"[ \t\r\f\v]*--\[(=*)\[")
+_LUA_BLANK     = re.compile(rb"^[ \t\r\f\v]*\n", re.M)
+_LUA_WS        = b" \t\r\f\v"
+
+def _find_pair(buf, first, seconds, i=0):
+    """
+    Posisi berikutnya `first` yang diikuti salah satu byte di `seconds`, atau -1.
+    bytes.find 1-byte (memchr) jauh lebih cepat dari pola 2-byte seperti b"--".
+    """
+    j = buf.find(first, i)
+    while j >= 0 and buf[j + 1:j + 2] not in seconds:
+        j = buf.find(first, j + 1)
+    return j
 
-def process_zip_to_cleaned(zip_path: str):
+class _LuaCleaner:
+    """
+    Lexer Lua minimal (level bytes) yang membuang komentar. State dibawa antar potongan,
+    jadi string / long string / block comment boleh melintasi batas chunk.
+    """
+    CODE, STR, LSTR, LCOM, BCOM = range(5)
+
+    def __init__(self, strip_blank):
+        self.strip_blank = strip_blank
+        self.mode = self.CODE
+        self.quote = b""    # pembuka short string
+        self.zskip = False  # short string berhenti di escape \z: whitespace berikutnya masih bagian string
+        self.close = b""    # penutup long string / block comment, mis. ]==]
+        self.ws = b""       # whitespace tertunda (dibuang bila ternyata sebelum komentar)
+        self.content = False  # baris ini sudah berisi kode
+        self.comment = False  # ada komentar yang dibuang di baris ini
+        self.changed = False
+        self.out = []
+
+    def feed(self, seg):
+        """seg: potongan input (idealnya berakhir di newline). Return bytes hasil."""
+        self.out = []
+        i, n = 0, len(seg)
+        # long bracket / escape bisa membawa state lintas baris; baris sebelum pola ini mulai di state kode
+        nxt_long, nxt_esc = _find_pair(seg, b"[", (b"[", b"=")), seg.find(b"\\")
+        pending = []  # baris utuh di state kode, diproses sekaligus oleh _lines
+        while i < n:
+            if self.mode != self.CODE or self.ws or self.content or self.comment:
+                end = seg.find(b"\n", i) + 1 or n
+                self._lex(seg[i:end])
+                i = end
+                continue
+            if 0 <= nxt_long < i:
+                nxt_long = _find_pair(seg, b"[", (b"[", b"="), i)
+            if 0 <= nxt_esc < i:
+                nxt_esc = seg.find(b"\\", i)
+            p = min(nxt_long if nxt_long >= 0 else n, nxt_esc if nxt_esc >= 0 else n)
+            start = seg.rfind(b"\n", i, p) + 1 or i
+            pending.append(seg[i:start])
+            bm = _LUA_BLOCK_LINE.match(seg, start) if p < n else None
+            if bm:
+                # block comment di awal baris yang ditutup lalu diikuti newline: buang langsung
+                close = seg.find(b"]" + bm.group(1) + b"]", bm.end())
+                end = seg.find(b"\n", close) + 1 if close >= 0 else 0
+                if end and not seg[close + len(bm.group(1)) + 2:end].strip():
+                    self.changed = True
+                    i = end
+                    continue
+            self._lines(b"".join(pending))
+            pending = []
+            end = seg.find(b"\n", start) + 1 or n
+            if end > start:
+                self._lex(seg[start:end])
+            i = end
+        if pending:
+            self._lines(b"".join(pending))
+        return b"".join(self.out)
+
+    def _lines(self, text):
+        """
+        Baris utuh tanpa long bracket / escape: tiap baris mulai di state kode, jadi
+        baris komentar penuh bisa dibuang dengan satu regex; hanya baris dengan '--' di tengah yang diperiksa.
+        """
+        if _find_pair(text, b"-", (b"-",)) < 0:
+            self._plain(text)
+            return
+        text, k = _LUA_LINE_COMMENT.subn(b"", b"\n" + text)
+        self.changed |= k > 0
+        find, pos, parts = text.find, 1, []
+        j = find(b"-", pos)
+        while j >= 0:
+            if text[j + 1] != 0x2D:  # '-' tunggal (minus)
+                j = find(b"-", j + 1)
+                continue
+            ls = text.rfind(b"\n", pos - 1, j) + 1  # text[pos - 1] selalu newline
+            le = find(b"\n", j) + 1
+            head = text[ls:j]
+            dq, sq = head.count(b'"'), head.count(b"'")
+            if dq & 1 or sq & 1 or (dq and sq):
+                # kutip tidak berpasangan / campur: '--' mungkin di dalam string -> lexer penuh
+                self._plain(b"".join(parts) + text[pos:ls])
+                parts = []
+                self._lex(text[ls:le])
+            else:
+                # trailing comment di luar string: potong, trailing whitespace ikut, newline asli tetap
+                parts += (text[pos:ls], head.rstrip(_LUA_WS), b"\r\n" if text[le - 2] == 0x0D else b"\n")
+                self.changed = True
+            pos = le
+            j = find(b"-", pos)
+        parts.append(text[pos:])
+        self._plain(b"".join(parts))
+
+    def _plain(self, text):
+        if not text:
+            return
+        if self.strip_blank:
+            cleaned = _LUA_BLANK.sub(b"", text)
+            self.changed |= len(cleaned) != len(text)
+            text = cleaned
+        self.out.append(text)
+
+    def finish(self):
+        self.out = []
+        if self.mode in (self.STR, self.LSTR) or (not self.comment and (self.content or not self.strip_blank)):
+            self.out.append(self.ws)
+        elif self.ws:
+            self.changed = True
+        self.ws = b""
+        return b"".join(self.out)
+
+    def _code(self, text):
+        if not text:
+            return
+        body = text.rstrip(_LUA_WS)
+        if body:
+            trailing = text[len(body):]
+            if self.comment and not self.content:
+                # sisa indentasi setelah block comment di awal baris
+                body = body.lstrip(_LUA_WS)
+                self.ws = b""
+            self.out.append(self.ws + body if self.ws else body)
+            self.content = True
+            self.ws = trailing
+        else:
+            self.ws += text
+
+    def _raw(self, text):
+        # isi string: selalu ditulis apa adanya
+        if text:
+            self.out.append(self.ws + text if self.ws else text)
+            self.ws = b""
+            self.content = True
+
+    def _eol(self):
+        if self.content:
+            if self.comment:
+                # trailing whitespace sebelum komentar ikut dibuang, gaya newline dipertahankan
+                self.out.append(b"\r\n" if self.ws.endswith(b"\r") else b"\n")
+            else:
+                self.out.append(self.ws + b"\n")
+        elif self.comment:
+            pass  # baris yang isinya hanya komentar
+        elif self.strip_blank:
+            self.changed = True
+        else:
+            self.out.append(self.ws + b"\n")
+        self.ws = b""
+        self.content = self.comment = False
+
+    def _lex(self, s):
+        i, n = 0, len(s)
+        while i < n:
+            mode = self.mode
+            if mode == self.CODE:
+                m = _LUA_TOKEN.search(s, i)
+                if m is None:
+                    self._code(s[i:])
+                    return
+                self._code(s[i:m.start()])
+                tok, i = m.group(), m.end()
+                if tok == b"\n":
+                    self._eol()
+                elif tok == b"--":
+                    self.comment = self.changed = True
+                    self.ws = b""
+                    lm = _LUA_LONG_OPEN.match(s, i)
+                    if lm:
+                        self.mode, self.close, i = self.BCOM, b"]" + lm.group(1) + b"]", lm.end()
+                    else:
+                        self.mode = self.LCOM
+                elif tok in (b'"', b"'"):
+                    self._raw(tok)
+                    self.mode, self.quote = self.STR, tok
+                else:
+                    self._raw(tok)
+                    self.mode, self.close = self.LSTR, b"]" + tok[1:-1] + b"]"
+            elif mode == self.STR:
+                zskip, self.zskip = self.zskip, False
+                j = _LUA_SPACE.match(s, i).end() if zskip else i
+                m = _LUA_STR_BODY[self.quote].match(s, j)
+                j = m.end()
+                if j < n and s[j:j + 1] == self.quote:
+                    j += 1
+                    self.mode = self.CODE
+                elif j < n and s[j:j + 1] == b"\n":
+                    self.mode = self.CODE  # string tidak ditutup di baris ini (Lua invalid): anggap selesai
+                else:
+                    # potongan habis di dalam string; setelah \z whitespace berikutnya masih dilewati
+                    self.zskip = m.end(1) == m.end() or (zskip and m.start() == m.end())
+                    j = n
+                self._raw(s[i:j])
+                i = j
+            elif mode == self.LSTR:
+                j = s.find(self.close, i)
+                if j < 0:
+                    self._raw(s[i:])
+                    return
+                j += len(self.close)
+                self._raw(s[i:j])
+                i, self.mode = j, self.CODE
+            elif mode == self.LCOM:
+                j = s.find(b"\n", i)
+                if j < 0:
+                    return
+                if j > i and s[j - 1:j] == b"\r":
+                    j -= 1  # CRLF: '\r' kembali ke kode supaya gaya newline tetap
+                i, self.mode = j, self.CODE
+            else:  # BCOM
+                j = s.find(self.close, i)
+                if j < 0:
+                    return
+                i, self.mode = j + len(self.close), self.CODE
+                # komentar di tengah kode tetap jadi pemisah token: x--[[c]]y -> x y
+                self.ws = b" " if self.content else b""
+
+def clean_lua_stream(src_fp, dst_fp, strip_blank=None):
+    """
+    Cleaner Lua berbasis lexer, streaming per LUA_CLEAN_CHUNK (memori terbatas), level bytes:
+    buang komentar `--`, `--[[ ]]` / `--[==[ ]==]` dan trailing comment; isi string & long string aman.
+    Baris yang kosong karena komentarnya dibuang ikut hilang; newline asli dipertahankan.
+    Return True bila ada yang berubah (False -> output byte-identik dengan input).
     """
-    Extract -> clean .lua -> remove README* -> repack ke zip baru di tempdir.
+    lexer = _LuaCleaner(LUA_STRIP_BLANK_LINES if strip_blank is None else strip_blank)
+    tail = b""
+    while True:
+        chunk = src_fp.read(LUA_CLEAN_CHUNK)
+        if not chunk:
+            break
+        buf = tail + chunk if tail else chunk
+        cut = buf.rfind(b"\n") + 1
+        if not cut:
+            if len(buf) < 4 * LUA_CLEAN_CHUNK:
+                tail = buf  # baris panjang: tunggu newline...
+                continue
+            cut = len(buf)  # ...tapi memori tetap terbatas: potong di luar token
+            while cut and buf[cut - 1] in b"-[]=\\\r":
+                cut -= 1
+            if not cut:
+                tail = buf
+                continue
+        out = lexer.feed(buf[:cut])
+        tail = buf[cut:]
+        if out:
+            dst_fp.write(out)
+    if tail:
+        dst_fp.write(lexer.feed(tail))
+    dst_fp.write(lexer.finish())
+    return lexer.changed
+
+def _safe_arcname(name):
+    """Normalisasi nama member seperti extractall (tanpa drive, '..', path absolut)."""
+    parts = []
+    for part in name.replace("\\", "/").split("/"):
+        if part in ("", ".", ".."):
+            continue
+        if not parts and len(part) >= 2 and part[1] == ":":
+            part = part[2:]
+            if not part:
+                continue
+        parts.append(part)
+    return "/".join(parts)
+
+def _is_readme(arc):
+    return arc.rsplit("/", 1)[-1].lower().startswith("readme")
+
+_RAW_COPY_METHODS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA)
+
+def _can_raw_copy(info):
+    # terenkripsi / metode yang tidak didukung zipfile tetap lewat jalur normal (error sama seperti dulu)
+    return REPACK_RAW_PASSTHROUGH and not (info.flag_bits & 0x1) and info.compress_type in _RAW_COPY_METHODS
+
+def _seek_member_data(raw_fp, info):
+    """Posisikan raw_fp di awal data member (lewati local header) memakai offset dari central directory."""
+    raw_fp.seek(info.header_offset)
+    fh = raw_fp.read(zipfile.sizeFileHeader)
+    if len(fh) != zipfile.sizeFileHeader or fh[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header: {info.filename}")
+    name_len, extra_len = struct.unpack("<2H", fh[26:30])
+    raw_fp.seek(name_len + extra_len, 1)
+
+def _open_member(raw_fp, info):
+    """
+    Stream isi member langsung dari file mentah (tanpa ZipFile / parse central directory ulang).
+    Output dibatasi file_size dari central directory; CRC dicek di EOF bila ZIP_VERIFY_CRC.
+    """
+    if info.flag_bits & 0x1:
+        raise RuntimeError(f"File {info.filename!r} is encrypted, password required for extraction")
+    _seek_member_data(raw_fp, info)
+    ext = zipfile.ZipExtFile(raw_fp, "r", info, None, False)
+    if not ZIP_VERIFY_CRC:
+        ext._expected_crc = None
+    return ext
+
+class _RawCrcCheck:
+    """Inflate chunk raw (STORED/DEFLATED) hanya untuk CRC, output dibuang per potongan (memori tetap kecil)."""
+
+    def __init__(self, info):
+        self.info = info
+        self.crc = 0
+        self.size = 0
+        self._d = zlib.decompressobj(-15) if info.compress_type == zipfile.ZIP_DEFLATED else None
+
+    def update(self, chunk):
+        while chunk:
+            if self._d is None:
+                out, chunk = chunk, b""
+            else:
+                out = self._d.decompress(chunk, 1 << 20)
+                chunk = self._d.unconsumed_tail
+            self.size += len(out)
+            if self.size > self.info.file_size:
+                raise zipfile.BadZipFile(f"Member lebih besar dari central directory: {self.info.filename}")
+            self.crc = zlib.crc32(out, self.crc)
+
+    def check(self):
+        if self.size != self.info.file_size or self.crc != self.info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {self.info.filename!r}")
+
+def _raw_copy_member(raw_fp, info, z2, zinfo, verified=False):
+    """
+    Salin bytes terkompresi member apa adanya dari zip sumber ke z2.
+    CRC, ukuran & metode kompresi diambil dari central directory sumber.
+    Dengan ZIP_VERIFY_RAW_CRC (STORED/DEFLATED), CRC dicek sambil menyalin;
+    verified=True: CRC sudah dicek saat member di-decompress (cleaner .lua), tidak di-inflate lagi.
+    """
+    _seek_member_data(raw_fp, info)
+    crc_check = _RawCrcCheck(info) if ZIP_VERIFY_RAW_CRC and not verified and \
+        info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) else None
+
+    zinfo.compress_type = info.compress_type
+    zinfo.flag_bits = info.flag_bits & ~0x08  # ukuran/CRC sudah diketahui -> tanpa data descriptor
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+
+    # Mengikuti ZipFile.write() untuk direktori: tulis header + data langsung ke fp arsip
+    with z2._lock:
+        z2._writecheck(zinfo)
+        z2._didModify = True
+        zinfo.header_offset = z2.fp.tell()
+        z2.fp.write(zinfo.FileHeader())
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = raw_fp.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated member: {info.filename}")
+            if crc_check is not None:
+                crc_check.update(chunk)
+            z2.fp.write(chunk)
+            remaining -= len(chunk)
+        if crc_check is not None:
+            crc_check.check()
+        z2.filelist.append(zinfo)
+        z2.NameToInfo[zinfo.filename] = zinfo
+        z2.start_dir = z2.fp.tell()
+
+def _reencoded_member(prev, info):
+    """
+    Member hasil lama boleh dipakai ulang untuk member sumber info (isi sama): hanya bila dulu ditulis
+    ulang oleh cleaner (isi hasil beda dari sumber) -> bytes-nya hanya bergantung pada isi + profil.
+    Member yang dulu disalin raw masih membawa kompresi sumber lama.
+    """
+    if (prev.flag_bits & 0x1) or prev.compress_type not in _RAW_COPY_METHODS:
+        return False
+    return prev.CRC != info.CRC or prev.file_size != info.file_size
+
+_ZIP_DATA_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError)
+
+_COMPRESS_METHODS = {"store": zipfile.ZIP_STORED, "deflate": zipfile.ZIP_DEFLATED,
+                     "bzip2": zipfile.ZIP_BZIP2, "lzma": zipfile.ZIP_LZMA}
+
+def set_compress_profile(name):
+    global COMPRESS_PROFILE
+    if name not in COMPRESS_PROFILES:
+        raise ValueError(f"Profil kompresi tidak dikenal: {name} (pilihan: {', '.join(COMPRESS_PROFILES)})")
+    COMPRESS_PROFILE = name
+
+def _compress_rule(arc):
+    """Aturan profil aktif untuk member ini: "keep" atau (method, level)."""
+    rules = COMPRESS_PROFILES[COMPRESS_PROFILE]
+    rule = rules.get(os.path.splitext(arc)[1].lower(), rules.get("*", "keep"))
+    if rule == "keep":
+        return rule
+    name, _, level = rule.partition(":")
+    if name in ("lzma", "bzip2") and not COMPRESS_ALLOW_LZMA:
+        name, level = "deflate", "9"
+    return _COMPRESS_METHODS[name], int(level) if level else None
+
+def _keeps_raw(rule, info):
+    """Member sumber boleh disalin raw: aturan "keep" atau sumber sudah memakai metode target."""
+    return rule == "keep" or info.compress_type == rule[0]
+
+def _pick_compression(rule, size, sample):
+    """(method, level) untuk member yang ditulis ulang; member kecil / sample yang tidak mengecil -> store."""
+    method, level = (zipfile.ZIP_DEFLATED, 6) if rule == "keep" else rule
+    if method != zipfile.ZIP_STORED:
+        if size < COMPRESS_MIN_BYTES:
+            return zipfile.ZIP_STORED, None
+        if len(sample) >= COMPRESS_MIN_BYTES and \
+                len(zlib.compress(sample, 1)) >= len(sample) * COMPRESS_PROBE_RATIO:
+            return zipfile.ZIP_STORED, None
+    return method, level
+
+def _write_member(src, z2, zinfo, size, rule):
+    """Tulis stream src ke z2 dengan metode dari aturan profil (+ probe dari potongan awal)."""
+    sample = src.read(COMPRESS_PROBE_BYTES)
+    zinfo.compress_type, zinfo._compresslevel = _pick_compression(rule, size, sample)
+    with z2.open(zinfo, "w", force_zip64=size > zipfile.ZIP64_LIMIT) as dst:
+        dst.write(sample)
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+def _stream_lua_member(raw_fp, info, z2, zinfo, raw_ok=False, rule="keep"):
+    """
+    Clean satu member .lua ke buffer (RAM, spill ke disk bila besar) lalu tulis ke z2 sesuai aturan kompresi.
+    Jika tidak ada yang dibuang (tanpa komentar), raw_ok dan metode sumber cocok dengan aturan,
+    member disalin raw (CRC sudah dicek saat clean).
+    Return ukuran hasil clean (> STREAM_SPILL_BYTES berarti buffer sempat di-spill ke disk).
+    """
+    with tempfile.SpooledTemporaryFile(max_size=STREAM_SPILL_BYTES, dir=REPACK_TEMP_DIR) as buf:
+        try:
+            with _open_member(raw_fp, info) as src:
+                changed = clean_lua_stream(src, buf)
+        except _ZIP_DATA_ERRORS:
+            raise
+        except Exception:
+            # gagal clean (bukan zip rusak) -> isi asli dipakai
+            buf.seek(0)
+            buf.truncate()
+            with _open_member(raw_fp, info) as src:
+                shutil.copyfileobj(src, buf, 1 << 20)
+            changed = False
+        size = buf.tell()
+        if raw_ok and not changed and _keeps_raw(rule, info):
+            _raw_copy_member(raw_fp, info, z2, zinfo, verified=ZIP_VERIFY_CRC)
+            return size
+        buf.seek(0)
+        _write_member(buf, z2, zinfo, size, rule)
+        return size
+
+def process_zip_to_cleaned(zip_path: str, timings=None, inspection=None, reuse=None, zstats=None):
+    """
+    Stream zip -> zip: clean .lua di memori, buang README*, member lain disalin langsung.
+    Dengan REPACK_RAW_PASSTHROUGH, member yang tidak berubah disalin raw (tanpa recompress).
+    Dengan REPACK_DETERMINISTIC, input yang sama menghasilkan zip yang byte-identik.
+    Tidak ada extract ke disk; tempdir hanya berisi zip hasil.
+    timings (dict, opsional): waktu member .lua (clean + deflate) ditambahkan ke timings["clean"] (ms).
+    inspection (ZipInspection, opsional): hasil tahap inspect; dipakai bila file belum berubah sejak itu.
+    reuse (opsional): (path hasil clean sebelumnya, set nama member yang tidak berubah) -> member .lua itu
+    yang dulu di-clean & dikompres ulang disalin raw dari hasil lama, tidak di-clean ulang. Member lain
+    (raw dari sumber) selalu diambil dari sumber baru -> hasil tetap byte-identik dengan repack penuh.
+    Metode kompresi per member mengikuti COMPRESS_PROFILE; zstats (dict, opsional) diisi
+    "raw" (total ukuran asli) & "out" (total terkompresi) member hasil, plus pemakaian puncak job:
+    "peak_temp" (zip hasil + spill di disk), "peak_mem" (buffer member terbesar di RAM) &
+    "reused" (jumlah member yang diambil dari hasil lama).
+    Temp di REPACK_TEMP_DIR; disk yang jelas tidak cukup -> ResourceBudgetError sebelum menulis.
+    Member rusak -> CorruptZipError.
     Return (cleaned_zip_path, appid, tempdir)
     """
     appid = os.path.splitext(os.path.basename(zip_path))[0]
-    temp_dir = tempfile.mkdtemp(prefix=f"ts_{appid}_")
-
-    with zipfile.ZipFile(zip_path, "r") as z:
-        z.extractall(temp_dir)
-
-    for root, _, files in os.walk(temp_dir):
-        for fn in files:
-            full = os.path.join(root, fn)
-            low = fn.lower()
-            if low.endswith(".lua"):
-                clean_lua_file(full)
-            if low.startswith("readme"):
-                try:
-                    os.remove(full)
-                except Exception:
-                    pass
-
+    temp_dir = tempfile.mkdtemp(prefix=f"ts_{appid}_", dir=REPACK_TEMP_DIR)
     out_zip = os.path.join(temp_dir, f"{appid}.zip")
-    with zipfile.ZipFile(out_zip, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as z2:
-        for root, _, files in os.walk(temp_dir):
-            for fn in files:
-                full = os.path.join(root, fn)
-                if os.path.abspath(full) == os.path.abspath(out_zip):
-                    continue
-                arc = os.path.relpath(full, temp_dir)
-                z2.write(full, arc)
+
+    try:
+        with open(zip_path, "rb") as raw_fp, contextlib.ExitStack() as stack:
+            if inspection is None or not inspection.matches(os.fstat(raw_fp.fileno())):
+                inspection = inspect_archive(zip_path)
+            if inspection.error:
+                raise zipfile.BadZipFile(inspection.error)
+            members = inspection.members
+            _check_temp_space(estimate_temp_bytes(members))
+            prev_fp, prev_members, reuse_arcs = None, {}, ()
+            if reuse:
+                prev_insp = inspect_archive(reuse[0])
+                if not prev_insp.error:
+                    prev_fp = stack.enter_context(open(reuse[0], "rb"))
+                    prev_members, reuse_arcs = prev_insp.members, reuse[1]
+
+            order = sorted(members) if REPACK_DETERMINISTIC else list(members)
+            now = time.localtime(time.time())[:6]
+            peak_temp = peak_mem = reused = 0
+            with zipfile.ZipFile(out_zip, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as z2:
+                written = z2.filelist
+                for arc in order:
+                    info = members[arc]
+                    if _is_readme(arc):
+                        continue
+                    low = arc.lower()
+                    if not REPACK_DETERMINISTIC:
+                        date_time = now
+                    elif REPACK_TIMESTAMP == "fixed":
+                        date_time = _FIXED_DATE_TIME
+                    else:
+                        date_time = info.date_time
+                    zinfo = zipfile.ZipInfo(arc, date_time=date_time)
+                    zinfo.create_system = 3  # atribut unix di bawah, sama di semua OS
+                    zinfo.external_attr = 0o100644 << 16
+                    raw_ok = _can_raw_copy(info)
+                    rule = _compress_rule(arc)
+                    prev = prev_members.get(arc) if arc in reuse_arcs and low.endswith(".lua") else None
+                    spill = 0
+                    try:
+                        if prev is not None and _reencoded_member(prev, info):
+                            _raw_copy_member(prev_fp, prev, z2, zinfo)
+                            reused += 1
+                        elif low.endswith(".lua"):
+                            t0 = time.perf_counter() if timings is not None else 0.0
+                            size = _stream_lua_member(raw_fp, info, z2, zinfo, raw_ok, rule)
+                            if size > STREAM_SPILL_BYTES:
+                                spill = size
+                            else:
+                                peak_mem = max(peak_mem, size)
+                            if timings is not None:
+                                timings["clean"] = timings.get("clean", 0.0) + (time.perf_counter() - t0) * 1000.0
+                        elif raw_ok and _keeps_raw(rule, info):
+                            _raw_copy_member(raw_fp, info, z2, zinfo)
+                        else:
+                            with _open_member(raw_fp, info) as src:
+                                _write_member(src, z2, zinfo, info.file_size, rule)
+                    except _ZIP_DATA_ERRORS as e:
+                        raise CorruptZipError(f"{info.filename}: {e}") from e
+                    peak_temp = max(peak_temp, z2.fp.tell() + spill)
+            if zstats is not None:
+                zstats["raw"] = sum(z.file_size for z in written)
+                zstats["out"] = sum(z.compress_size for z in written)
+                zstats["peak_temp"] = max(peak_temp, os.path.getsize(out_zip))
+                zstats["peak_mem"] = peak_mem
+                zstats["reused"] = reused
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
 
     return out_zip, appid, temp_dir
 
+# ========= RESOURCE BUDGET =========
+class ResourceBudgetError(RuntimeError):
+    """Job tidak mungkin muat di disk temp (bahkan bila berjalan sendirian)."""
+
+def _temp_root():
+    return REPACK_TEMP_DIR or tempfile.gettempdir()
+
+def _temp_free():
+    try:
+        return shutil.disk_usage(_temp_root()).free
+    except OSError:
+        return float("inf")
+
+def estimate_temp_bytes(members):
+    """
+    Perkiraan byte temp satu repack: zip hasil (member "store" dihitung ukuran asli, lainnya ukuran terkompresi
+    sumber + 1/8 cadangan) ditambah spill .lua terbesar di atas STREAM_SPILL_BYTES.
+    """
+    out = spill = 0
+    for arc, info in members.items():
+        if _is_readme(arc):
+            continue
+        rule = _compress_rule(arc)
+        stored = rule != "keep" and rule[0] == zipfile.ZIP_STORED
+        out += (info.file_size if stored else info.compress_size) + 2 * len(arc.encode("utf-8")) + 128
+        if arc.lower().endswith(".lua") and info.file_size > STREAM_SPILL_BYTES:
+            spill = max(spill, info.file_size)
+    return out + out // 8 + spill
+
+def job_temp_estimate(src, inspection=None):
+    """estimate_temp_bytes untuk file zip (central directory saja); 0 bila tidak terbaca (gagal di tahap inspect)."""
+    try:
+        insp = inspection or inspect_archive(src)
+    except Exception:
+        return 0
+    return 0 if insp.error else estimate_temp_bytes(insp.members)
+
+def _check_temp_space(est):
+    free = _temp_free()
+    if free < est:
+        raise ResourceBudgetError(f"disk temp tidak cukup: butuh ~{est / (1 << 20):.0f} MB di {_temp_root()}, "
+                                  f"sisa {free / (1 << 20):.0f} MB (atur REPACK_TEMP_DIR / --temp-dir)")
+
+class ResourceBudget:
+    """
+    Penjadwal job repack berdasarkan perkiraan byte temp. Job ditahan selama total temp job aktif + job ini
+    melebihi max_temp, disk temp tidak menyisakan reserve, atau job besar lain sudah max_large.
+    Job yang sendirian selalu boleh jalan -> paket raksasa diproses bergiliran, tidak menunggu selamanya.
+    Tiket dipegang sampai tempdir dibuang (discard_prep), karena zip hasil tetap di temp sampai dikirim.
+    """
+
+    def __init__(self, max_temp, large_bytes, max_large, reserve):
+        self.max_temp = max_temp
+        self.large_bytes = large_bytes
+        self.max_large = max_large
+        self.reserve = reserve
+        self._cond = threading.Condition()
+        self.jobs = 0
+        self.large = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def _fits(self, est):
+        if not self.jobs:
+            return True
+        if est >= self.large_bytes and self.large >= self.max_large:
+            return False
+        if self.in_use + est > self.max_temp:
+            return False
+        return _temp_free() - self.reserve >= self.in_use + est
+
+    def _take(self, est):
+        large = est >= self.large_bytes
+        self.jobs += 1
+        self.large += large
+        self.in_use += est
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return est, large
+
+    def try_acquire(self, est):
+        """Tiket bila muat sekarang, else None."""
+        with self._cond:
+            return self._take(est) if self._fits(est) else None
+
+    def acquire(self, est, stop_event=None):
+        """Tunggu sampai muat; None bila stop_event di-set selama menunggu."""
+        with self._cond:
+            while not self._fits(est):
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                self._cond.wait(0.5)  # disk temp juga bisa lega karena proses lain
+            return self._take(est)
+
+    def release(self, ticket):
+        est, large = ticket
+        with self._cond:
+            self.jobs -= 1
+            self.large -= large
+            self.in_use -= est
+            self._cond.notify_all()
+
+_resource_budget = None
+_resource_budget_guard = threading.Lock()
+
+def get_resource_budget():
+    """ResourceBudget proses ini (dipakai bersama batch & Auto-Watch)."""
+    global _resource_budget
+    with _resource_budget_guard:
+        if _resource_budget is None:
+            _resource_budget = ResourceBudget(BUDGET_TEMP_BYTES, BUDGET_LARGE_JOB_BYTES, BUDGET_MAX_LARGE_JOBS,
+                                              BUDGET_TEMP_RESERVE_BYTES)
+        return _resource_budget
+
+def reserve_budget(prep, ui=None, stop_event=None):
+    """
+    Ambil tiket anggaran untuk prep hasil lookup_stage (prep["budget"], dilepas discard_prep);
+    waktu tunggu -> prep["budget_wait_ms"]. Hasil yang dipakai ulang (prep["cached"]) tidak di-repack
+    -> tanpa tiket. False bila dihentikan saat menunggu.
+    """
+    if prep["status"] != "ok" or prep.get("cached"):
+        return True
+    est = job_temp_estimate(prep["src"], prep.get("inspection"))
+    budget = get_resource_budget()
+    t0 = time.perf_counter()
+    ticket = budget.try_acquire(est)
+    if ticket is None:
+        if ui is not None:
+            ui.log(f"⏳ Menunggu anggaran temp: {os.path.basename(prep['src'])} (~{est / (1 << 20):.0f} MB)")
+        ticket = budget.acquire(est, stop_event)
+        if ticket is None:
+            return False
+    prep["budget"] = ticket
+    prep["budget_wait_ms"] = (time.perf_counter() - t0) * 1000.0
+    return True
+
+def set_repack_temp_dir(path):
+    global REPACK_TEMP_DIR
+    if path:
+        path = os.path.abspath(path)
+        _ensure_dir(path)
+    REPACK_TEMP_DIR = path or None
+
+# ========= RESULT CACHE =========
+class ResultCache:
+    """
+    Cache hasil clean: key (MD5 sumber + resep cleaner) -> (MD5 output, size, lokasi di CLEAN_DIR).
+    LRU dibatasi RESULT_CACHE_MAX_ENTRIES. Persisten append-only seperti DirIndex;
+    hit juga ditulis ulang supaya urutan LRU bertahan setelah restart.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._d = collections.OrderedDict()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        n_lines = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 4:
+                    continue
+                n_lines += 1
+                try:
+                    ent = {"out_md5": parts[1], "size": int(parts[2]), "path": parts[3]}
+                except ValueError:
+                    continue
+                self._d.pop(parts[0], None)
+                self._d[parts[0]] = ent
+        while len(self._d) > self.max_entries:
+            self._d.popitem(last=False)
+        if n_lines > 2 * len(self._d) + 100:
+            self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for key, ent in self._d.items():
+                f.write(f"{key}\t{ent['out_md5']}\t{ent['size']}\t{ent['path']}\n")
+        os.replace(tmp, self.path)
+
+    def _append(self, key, ent):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(f"{key}\t{ent['out_md5']}\t{ent['size']}\t{ent['path']}\n")
+
+    def lookup(self, key):
+        with self._lock:
+            ent = self._d.get(key)
+            if ent is None:
+                return None
+            self._d.move_to_end(key)
+            try:
+                self._append(key, ent)
+            except Exception:
+                pass
+            return dict(ent)
+
+    def record(self, key, out_md5, size, path):
+        ent = {"out_md5": out_md5, "size": size, "path": os.path.abspath(path)}
+        with self._lock:
+            if self._d.get(key) == ent:
+                self._d.move_to_end(key)
+                return
+            self._d.pop(key, None)
+            self._d[key] = ent
+            while len(self._d) > self.max_entries:
+                self._d.popitem(last=False)
+            self._append(key, ent)
+
+    def forget(self, key):
+        with self._lock:
+            self._d.pop(key, None)
+
+_result_cache = None
+_result_cache_guard = threading.Lock()
+
+def get_result_cache():
+    global _result_cache
+    with _result_cache_guard:
+        if _result_cache is None:
+            _result_cache = ResultCache(RESULT_CACHE_DB, RESULT_CACHE_MAX_ENTRIES)
+        return _result_cache
+
+def _clean_recipe():
+    """Semua setting yang mempengaruhi isi hasil clean."""
+    recipe = f"c{CLEANER_VERSION}"
+    if LUA_STRIP_BLANK_LINES:
+        recipe += "-nb"
+    if REPACK_DETERMINISTIC:
+        recipe += f"-det-{REPACK_TIMESTAMP}"
+    recipe += f"-z{COMPRESS_PROFILE}" + ("-x" if COMPRESS_ALLOW_LZMA else "")
+    return recipe
+
+def result_cache_key(src_md5):
+    """MD5 sumber + resep cleaner."""
+    return f"{src_md5}:{_clean_recipe()}"
+
+def _verify_cached_result(ent, digests):
+    """Hasil cache masih valid bila file di lokasi itu masih punya MD5 yang sama (cek via index)."""
+    try:
+        st = os.stat(ent["path"])
+        if st.st_size != ent["size"]:
+            return False
+        index = get_dir_index(os.path.dirname(ent["path"]))
+        return _indexed_md5(ent["path"], st, digests, index) == ent["out_md5"]
+    except Exception:
+        return False
+
+# ========= MEMBER MANIFEST (incremental per member) =========
+class MemberManifest:
+    """
+    Per appid (+ resep cleaner): CRC & size tiap member sumber yang masuk ke hasil clean terakhir,
+    plus lokasi/MD5/size hasil itu. Versi baru paket dengan appid sama dibandingkan per member
+    (dari central directory): .lua yang sama diambil dari hasil lama, hanya yang berubah di-clean.
+    Disimpan di tabel member_manifest (HISTORY_DB); dibatasi max_entries, yang terlama direkam dibuang.
+    """
+
+    TRIM_EVERY = 1000  # record
+
+    def __init__(self, path, max_entries):
+        _ensure_dir(os.path.dirname(path))
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS member_manifest ("
+                               "key TEXT PRIMARY KEY, out_md5 TEXT NOT NULL, size INTEGER NOT NULL, "
+                               "path TEXT NOT NULL, members TEXT NOT NULL, recorded REAL NOT NULL) WITHOUT ROWID")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_member_manifest_recorded "
+                               "ON member_manifest(recorded)")
+        self._since_trim = 0
+        self._trim()
+
+    def _trim(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM member_manifest WHERE key IN (SELECT key FROM member_manifest "
+                               "ORDER BY recorded DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._since_trim = 0
+
+    def lookup(self, appid):
+        with self._lock:
+            row = self._conn.execute("SELECT out_md5, size, path, members FROM member_manifest WHERE key = ?",
+                                     (f"{appid}:{_clean_recipe()}",)).fetchone()
+        if row is None:
+            return None
+        try:
+            members = json.loads(row[3])
+        except ValueError:
+            return None
+        return {"out_md5": row[0], "size": row[1], "path": row[2], "members": members}
+
+    def record(self, appid, members, out_md5, size, path):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO member_manifest (key, out_md5, size, path, members, recorded) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (f"{appid}:{_clean_recipe()}", out_md5, size, os.path.abspath(path),
+                 json.dumps(members, separators=(",", ":")), time.time()))
+            self._since_trim += 1
+            trim = self._since_trim >= self.TRIM_EVERY
+        if trim:
+            self._trim()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_member_manifest = None
+_member_manifest_guard = threading.Lock()
+
+def get_member_manifest():
+    global _member_manifest
+    with _member_manifest_guard:
+        if _member_manifest is None:
+            _member_manifest = MemberManifest(HISTORY_DB, MEMBER_MANIFEST_MAX_ENTRIES)
+        return _member_manifest
+
+def _member_signature(inspection):
+    """arc -> [CRC, size] untuk member yang masuk ke hasil clean (README dibuang)."""
+    return {arc: [info.CRC, info.file_size] for arc, info in inspection.members.items() if not _is_readme(arc)}
+
 # ========= CORE PROCESS =========
-def process_one_zip(src, clean_dir, drive_dir, ui: UILogger):
-    """Return result string."""
+def _tick():
+    return time.perf_counter() if METRICS_ENABLED else 0.0
+
+def _lap(prep, stage, t0):
+    """Tambahkan waktu sejak t0 (ms) ke prep["timings"][stage]. No-op bila METRICS_ENABLED mati."""
+    if METRICS_ENABLED:
+        _add_ms(prep, stage, (time.perf_counter() - t0) * 1000.0)
+
+def _add_ms(prep, stage, ms):
+    timings = prep.setdefault("timings", {})
+    timings[stage] = timings.get(stage, 0.0) + ms
+
+def _prep_metrics(prep):
+    """Kolom METRIC_COLUMNS untuk history dari prep; None bila instrumentasi mati."""
+    timings = prep.get("timings")
+    if not METRICS_ENABLED or timings is None:
+        return None
+    m = {f"{s}_ms": round(timings[s], 2) for s in STAGE_NAMES if s in timings}
+    m["total_ms"] = round(sum(timings.values()), 2)
+    m["bytes_in"] = prep.get("bytes_in")
+    m["bytes_out"] = prep.get("bytes_out")
+    if "budget_wait_ms" in prep:
+        m["budget_wait_ms"] = round(prep["budget_wait_ms"], 2)
+    zstats = prep.get("zstats") or {}
+    m["peak_temp_bytes"] = zstats.get("peak_temp")
+    m["peak_mem_bytes"] = zstats.get("peak_mem")
+    return m
+
+def _repack_prep(prep, reuse=None):
+    """
+    process_zip_to_cleaned + timing: .lua (clean+deflate) -> "clean", sisanya -> "repack".
+    prep["zstats"]: profil kompresi, byte asli/terkompresi & CPU thread (ms) repack ini.
+    """
+    timings = {} if METRICS_ENABLED else None
+    zstats = {"profile": COMPRESS_PROFILE}
+    t0 = _tick()
+    cpu0 = time.thread_time()
+    prep["cleaned_zip"], prep["appid"], prep["tmpdir"] = process_zip_to_cleaned(
+        prep["src"], timings, prep.pop("inspection", None), reuse, zstats)
+    zstats["cpu_ms"] = (time.thread_time() - cpu0) * 1000.0
+    prep["zstats"] = zstats
+    if timings is not None:
+        total = (time.perf_counter() - t0) * 1000.0
+        clean = timings.get("clean", 0.0)
+        _add_ms(prep, "clean", clean)
+        _add_ms(prep, "repack", total - clean)
+
+def inspect_stage(src, digests=None):
+    """Tahap 1: validasi + MD5 sumber (satu kali baca, central directory dari ekor file). Return dict prep."""
+    prep = {"src": src, "status": "ok", "zip_md5": "", "src_key": None, "appid": "",
+            "cleaned_zip": None, "tmpdir": None, "cached": None, "error": "", "reason": "", "inspection": None,
+            "members": None, "reused": 0}
+    if METRICS_ENABLED:
+        prep["timings"] = {}
     try:
+        t0 = _tick()
+        digests = digests or DigestCache()
+        st = os.stat(src)
+        prep["src_key"] = _stat_key(src, st)
+        prep["bytes_in"] = st.st_size
         # Validasi isi ZIP (wajib .lua + .manifest)
-        if not is_valid_manifest_zip(src):
-            ui.log(f"❌ Skip: {os.path.basename(src)} — Bukan manifest package, dilewati")
-            append_log("validate", src, "", "skip_invalid", md5_file(src), "", "", "no .lua/.manifest")
-            return "skip-invalid"
+        prep["zip_md5"], valid, prep["reason"], prep["inspection"] = digests.inspect_zip(src, st)
+        _lap(prep, "inspect", t0)
+        if not valid:
+            prep["status"] = "skip-invalid"
+            prep["inspection"] = None
+    except Exception as e:
+        prep["status"] = "error"
+        prep["error"] = str(e)
+    return prep
+
+def lookup_stage(prep):
+    """
+    Tahap 1b: hasil yang bisa dipakai tanpa repack -> prep["cached"]: result cache (MD5 sumber + resep sama)
+    atau isi semua member sama dengan hasil clean terakhir appid yang sama (MemberManifest);
+    sebagian sama -> prep["reuse"] untuk clean_stage. Jalan sebelum reserve_budget: hit tidak butuh tiket temp.
+    """
+    if prep["status"] != "ok" or prep.get("looked_up"):
+        return prep
+    prep["looked_up"] = True
+    src = prep["src"]
+    try:
+        appid = os.path.splitext(os.path.basename(src))[0]
+        # Sudah pernah di-clean dengan resep yang sama -> langsung ke tahap copy/verify
+        cached = get_result_cache().lookup(result_cache_key(prep["zip_md5"]))
+        if cached:
+            prep["cached"] = cached
+            prep["appid"] = appid
+            prep["inspection"] = None
+            return prep
+
+        insp = prep.get("inspection") or inspect_archive(src)
+        prep["inspection"] = insp
+        if not insp.error:
+            prep["members"] = _member_signature(insp)
+            prev = get_member_manifest().lookup(appid)
+            if prev and _verify_cached_result(prev, DigestCache()):
+                same = {arc for arc, sig in prep["members"].items() if prev["members"].get(arc) == sig}
+                if same and len(same) == len(prep["members"]) == len(prev["members"]):
+                    # isi semua member sama (hanya timestamp / kompresi sumber / README beda) -> hasil lama
+                    # dipakai apa adanya, CLEAN_DIR & DRIVE_DIR tidak ditulis ulang
+                    prep["cached"] = {"path": prev["path"], "out_md5": prev["out_md5"], "size": prev["size"]}
+                    prep["appid"] = appid
+                    prep["reused"] = len(same)
+                    prep["inspection"] = None
+                    return prep
+                if same:
+                    prep["reuse"] = (prev["path"], same)
+    except Exception as e:
+        prep["status"] = "error"
+        prep["error"] = str(e)
+    return prep
 
-        zip_md5 = md5_file(src)
-        cleaned_zip, appid, tmpdir = process_zip_to_cleaned(src)
+def clean_stage(prep):
+    """
+    Tahap 2: repack bila lookup_stage tidak menemukan hasil yang bisa dipakai; .lua yang tidak berubah
+    diambil dari hasil clean terakhir appid yang sama, hanya yang berubah di-clean.
+    """
+    lookup_stage(prep)
+    if prep["status"] != "ok" or prep["cached"]:
+        return prep
+    try:
+        _repack_prep(prep, prep.pop("reuse", None))
+        prep["reused"] = prep["zstats"].get("reused", 0)
+    except CorruptZipError as e:
+        prep["status"] = "corrupt"
+        prep["error"] = str(e)
+    except Exception as e:
+        prep["status"] = "error"
+        prep["error"] = str(e)
+    return prep
+
+def discard_prep(prep):
+    """Hapus tempdir hasil repack (sudah dikirim / tidak jadi dikirim) dan lepas tiket anggaran temp-nya."""
+    tmpdir = prep.get("tmpdir")
+    if tmpdir and os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    ticket = prep.pop("budget", None)
+    if ticket is not None:
+        get_resource_budget().release(ticket)
+
+def _invalid_label(reason):
+    return "Bukan manifest package" if reason == "no .lua/.manifest" else reason
+
+def deliver_zip(prep, clean_dir, drive_dir, ui: UILogger, digests=None):
+    """Tahap I/O: simpan ke CLEAN_DIR, copy ke DRIVE_DIR, tulis history. Return result string."""
+    src = prep["src"]
+    digests = digests or DigestCache()
+    if prep.get("src_key") and prep.get("zip_md5"):
+        digests.put_key(prep["src_key"], prep["zip_md5"], prep["status"] != "skip-invalid", prep.get("reason", ""))
+    try:
+        if prep["status"] == "skip-invalid":
+            reason = prep.get("reason") or "no .lua/.manifest"
+            ui.log(f"❌ Skip: {os.path.basename(src)} — {_invalid_label(reason)}, dilewati")
+            append_log("validate", src, "", "skip_invalid", prep["zip_md5"], "", "", reason)
+            return "skip-invalid"
+        if prep["status"] == "corrupt":
+            ui.log(f"❌ Corrupt: {os.path.basename(src)} — {prep['error']}")
+            append_log("validate", src, "", "corrupt", prep["zip_md5"], "", "", prep["error"])
+            return "corrupt"
+        if prep["status"] == "error":
+            raise RuntimeError(prep["error"])
+
+        zip_md5 = prep["zip_md5"]
+        appid = prep["appid"]
+        cache_key = result_cache_key(zip_md5)
+        cached = prep.get("cached")
+        if cached and not _verify_cached_result(cached, digests):
+            # hasil lama sudah tidak ada / berubah -> clean ulang
+            get_result_cache().forget(cache_key)
+            cached = prep["cached"] = None
+            prep["reused"] = 0
+            if "budget" not in prep:
+                reserve_budget(prep, ui)  # tiket dilepas discard_prep di finally
+            _repack_prep(prep)
+            appid = prep["appid"]
+        if cached:
+            notes = "members-unchanged" if prep.get("reused") else "cache-hit"
+        elif prep.get("reused"):
+            notes = f"reused {prep['reused']}/{len(prep['members'])} member"
+        else:
+            notes = ""
 
         # Simpan ke CLEAN_DIR (no subfolder)
         clean_target = os.path.join(clean_dir, f"{appid}.zip")
+        cleaned_src = cached["path"] if cached else prep["cleaned_zip"]
         try:
-            st_local = copy_auto_replace(cleaned_zip, clean_target)
-            if st_local == "copied":
-                ui.log(f"🧼 Saved cleaned to CLEAN_DIR: {os.path.basename(clean_target)}")
+            if cached and os.path.normcase(cached["path"]) == os.path.normcase(os.path.abspath(clean_target)):
+                if prep.get("reused"):
+                    ui.log(f"⚡ Member tidak berubah, hasil lama dipakai: {os.path.basename(clean_target)}")
+                    get_result_cache().record(cache_key, cached["out_md5"], cached["size"], clean_target)
+                else:
+                    ui.log(f"⚡ Cache hit (sudah di-clean): {os.path.basename(clean_target)}")
+                prep["bytes_out"] = cached["size"]
+                out_md5 = cached["out_md5"]
             else:
-                ui.log(f"⏭️ Skip (identical already in CLEAN_DIR): {os.path.basename(clean_target)}")
+                t0 = _tick()
+                st_local = copy_auto_replace(cleaned_src, clean_target, digests)
+                _lap(prep, "copy_clean", t0)
+                if st_local == "copied":
+                    ui.log(f"🧼 Saved cleaned to CLEAN_DIR: {os.path.basename(clean_target)}")
+                else:
+                    ui.log(f"⏭️ Skip (identical already in CLEAN_DIR): {os.path.basename(clean_target)}")
+                st_clean = os.stat(clean_target)
+                prep["bytes_out"] = st_clean.st_size
+                out_md5 = _indexed_md5(clean_target, st_clean, digests, get_dir_index(clean_dir))
+                get_result_cache().record(cache_key, out_md5, st_clean.st_size, clean_target)
+            if prep.get("members"):
+                get_member_manifest().record(appid, prep["members"], out_md5, prep["bytes_out"], clean_target)
         except Exception as e:
             ui.log(f"⚠️ Gagal salin ke CLEAN_DIR: {e}")
 
@@ -254,7 +2096,9 @@ def process_one_zip(src, clean_dir, drive_dir, ui: UILogger):
         drive_target = os.path.join(drive_dir, f"{appid}.zip")
         drive_status = ""
         try:
-            st = copy_auto_replace(clean_target, drive_target)
+            t0 = _tick()
+            st = copy_auto_replace(clean_target, drive_target, digests)
+            _lap(prep, "copy_drive", t0)
             if st == "copied":
                 ui.log(f"✅ Copied to Drive: {os.path.basename(drive_target)}")
                 drive_status = "copied"
@@ -262,18 +2106,25 @@ def process_one_zip(src, clean_dir, drive_dir, ui: UILogger):
                 ui.log(f"⏭️ Skip (identical on Drive): {os.path.basename(drive_target)}")
                 drive_status = "exists-identical"
         except Exception as e:
-            ui.log(f"❌ Copy to Drive folder failed: {e}")
+            ui.log(f"❌ Copy to Drive folder failed: {e} — masuk antrean retry")
             drive_status = f"copy-failed: {e}"
+            get_retry_queue().add(clean_target, drive_target, str(e))
+            notes = (notes + "; " if notes else "") + "retry-queued"
+        else:
+            get_retry_queue().discard(drive_target)
 
-        append_log("process", src, appid, drive_status or "done", zip_md5, clean_target, drive_target, "")
+        metrics = _prep_metrics(prep)
+        append_log("process", src, appid, drive_status or "done", zip_md5, clean_target, drive_target, notes,
+                   metrics)
         add_processed_md5(zip_md5)
-
-        # Bersihkan tempdir
-        try:
-            if tmpdir and os.path.isdir(tmpdir):
-                shutil.rmtree(tmpdir)
-        except Exception:
-            pass
+        if metrics:
+            get_stage_stats().record(metrics)
+        if prep.get("zstats") and not cached:
+            get_stage_stats().record_compression(prep["zstats"])
+            peak = prep["zstats"].get("peak_temp") or 0
+            if peak >= BUDGET_LARGE_JOB_BYTES:
+                ui.log(f"📦 Paket besar: temp puncak {peak / (1 << 20):.0f} MB, "
+                       f"buffer RAM {prep['zstats'].get('peak_mem', 0) / (1 << 20):.0f} MB")
 
         return drive_status or "done"
 
@@ -282,176 +2133,1280 @@ def process_one_zip(src, clean_dir, drive_dir, ui: UILogger):
         append_log("error", src, "", "error", "", "", "", str(e))
         return "error"
 
-# ========= AUTO-WATCH THREAD =========
-class WatcherThread(threading.Thread):
-    def __init__(self, watch_dir, clean_dir, drive_dir, ui: UILogger, stop_event: threading.Event):
+    finally:
+        # Bersihkan tempdir
+        discard_prep(prep)
+
+def process_one_zip(src, clean_dir, drive_dir, ui: UILogger, digests=None):
+    """Return result string."""
+    digests = digests or DigestCache()
+    prep = lookup_stage(inspect_stage(src, digests))
+    reserve_budget(prep, ui)
+    return deliver_zip(clean_stage(prep), clean_dir, drive_dir, ui, digests)
+
+# ========= DRIVE RETRY QUEUE =========
+class RetryQueue:
+    """
+    Copy ke DRIVE_DIR yang gagal, disimpan di tabel retry_queue (HISTORY_DB) -> tetap ada setelah restart.
+    Satu entri per file tujuan; jeda retry RETRY_BASE_S, dobel tiap gagal, maksimal RETRY_MAX_S.
+    """
+
+    def __init__(self, path):
+        _ensure_dir(os.path.dirname(path))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS retry_queue ("
+                               "dst TEXT PRIMARY KEY, src TEXT NOT NULL, attempts INTEGER NOT NULL, "
+                               "next_at REAL NOT NULL, last_error TEXT, created TEXT) WITHOUT ROWID")
+        # salinan di memori: discard() untuk copy yang sukses tidak perlu menyentuh DB
+        self._dsts = {r[0] for r in self._conn.execute("SELECT dst FROM retry_queue")}
+
+    @staticmethod
+    def backoff(attempts):
+        return min(RETRY_BASE_S * 2 ** max(attempts - 1, 0), RETRY_MAX_S)
+
+    def __len__(self):
+        return len(self._dsts)
+
+    def add(self, src, dst, error):
+        """Copy baru yang gagal: (ulang) jadwalkan dari attempt 1."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO retry_queue (dst, src, attempts, next_at, last_error, created) "
+                "VALUES (?, ?, 1, ?, ?, ?)",
+                (dst, src, time.time() + self.backoff(1), error,
+                 datetime.datetime.now().isoformat(timespec="seconds")))
+            self._dsts.add(dst)
+
+    def reschedule(self, dst, attempts, error):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE retry_queue SET attempts = ?, next_at = ?, last_error = ? WHERE dst = ?",
+                               (attempts, time.time() + self.backoff(attempts), error, dst))
+
+    def discard(self, dst):
+        if dst not in self._dsts:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM retry_queue WHERE dst = ?", (dst,))
+            self._dsts.discard(dst)
+
+    def due(self, now=None):
+        """Entri yang sudah waktunya dicoba: list (dst, src, attempts)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute("SELECT dst, src, attempts FROM retry_queue WHERE next_at <= ? "
+                                      "ORDER BY next_at", (now,)).fetchall()
+
+    def next_due(self):
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_at) FROM retry_queue").fetchone()
+        return row[0] if row else None
+
+    def run_due(self, ui, digests=None):
+        """Satu putaran: coba ulang semua entri yang jatuh tempo. Return Counter hasil."""
+        results = collections.Counter()
+        digests = digests or DigestCache()
+        for dst, src, attempts in self.due():
+            name = os.path.basename(dst)
+            appid = os.path.splitext(name)[0]
+            if not os.path.exists(src):
+                self.discard(dst)
+                ui.log(f"⚠️ Retry dibatalkan (file clean hilang): {name}")
+                append_log("retry", src, appid, "retry-dropped", "", src, dst, "source missing")
+                results["retry-dropped"] += 1
+                continue
+            try:
+                st = copy_auto_replace(src, dst, digests)
+            except Exception as e:
+                attempts += 1
+                if attempts > RETRY_MAX_ATTEMPTS:
+                    self.discard(dst)
+                    ui.log(f"❌ Retry menyerah setelah {RETRY_MAX_ATTEMPTS}x: {name} -> {e}")
+                    append_log("retry", src, appid, "retry-gave-up", "", src, dst, str(e))
+                    results["retry-gave-up"] += 1
+                else:
+                    self.reschedule(dst, attempts, str(e))
+                    ui.log(f"⚠️ Retry #{attempts - 1} gagal: {name} -> {e} (coba lagi {self.backoff(attempts):.0f}s)")
+                    results["retry-failed"] += 1
+                continue
+            self.discard(dst)
+            ui.log(f"✅ Retry copied to Drive: {name}")
+            append_log("retry", src, appid, st, "", src, dst, f"attempt {attempts + 1}")
+            results[st] += 1
+        return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_retry_queue = None
+_retry_queue_guard = threading.Lock()
+
+def get_retry_queue():
+    global _retry_queue
+    with _retry_queue_guard:
+        if _retry_queue is None:
+            _retry_queue = RetryQueue(HISTORY_DB)
+        return _retry_queue
+
+class RetryWorker(threading.Thread):
+    """Thread latar yang menguras RetryQueue sampai stop_event diset."""
+
+    def __init__(self, ui: UILogger, stop_event: threading.Event):
         super().__init__(daemon=True)
-        self.watch_dir = watch_dir
-        self.clean_dir = clean_dir
-        self.drive_dir = drive_dir
         self.ui = ui
         self.stop_event = stop_event
-        self.seen_md5 = load_processed_md5()  # md5 zip yang sudah pernah diproses
-        self.seen_triplets = set()  # (path, size, mtime) per sesi
 
     def run(self):
-        self.ui.log(f"👀 Auto-Watch aktif di: {self.watch_dir}")
+        rq = get_retry_queue()
+        digests = DigestCache()
+        if len(rq):
+            self.ui.log(f"🔁 Antrean retry Drive: {len(rq)} file")
         while not self.stop_event.is_set():
             try:
-                for entry in os.scandir(self.watch_dir):
-                    if not entry.is_file() or not entry.name.lower().endswith(".zip"):
-                        continue
+                rq.run_due(self.ui, digests)
+                nxt = rq.next_due()
+            except Exception as e:
+                self.ui.log(f"⚠️ Retry worker: {e}")
+                nxt = None
+            # entri baru paling cepat jatuh tempo RETRY_BASE_S lagi -> cek ulang berkala sudah cukup
+            wait = RETRY_BASE_S if nxt is None else nxt - time.time()
+            self.stop_event.wait(min(max(wait, 0.5), RETRY_BASE_S))
+
+# ========= RECONCILE (CLEAN_DIR -> DRIVE_DIR) =========
+def _scan_zips(directory):
+    """Nama -> stat semua .zip di folder (satu scandir, tanpa membaca isi)."""
+    out = {}
+    for entry in os.scandir(directory):
+        if entry.name.lower().endswith(".zip") and entry.is_file():
+            try:
+                out[entry.name] = entry.stat()
+            except OSError:
+                pass
+    return out
 
-                    path = entry.path
-                    try:
-                        stat = entry.stat()
-                        trip = (path, stat.st_size, int(stat.st_mtime))
-                    except Exception:
-                        trip = (path, 0, 0)
+def reconcile_diff(clean_dir, drive_dir, digests=None, workers=None):
+    """
+    Bandingkan CLEAN_DIR dengan DRIVE_DIR: ada/tidak -> size -> mtime -> MD5 (index dulu, isi file
+    dibaca hanya bila index tidak cocok). Return dict: missing, stale, extra, identical (list nama)
+    + hashed (jumlah file yang isinya terpaksa dibaca).
+    """
+    digests = digests or DigestCache()
+    src, dst = _scan_zips(clean_dir), _scan_zips(drive_dir)
+    src_index, dst_index = get_dir_index(clean_dir), get_dir_index(drive_dir)
+    diff = {"missing": [], "stale": [], "extra": sorted(set(dst) - set(src)), "identical": [], "hashed": 0}
+    check = []
+    for name in sorted(src):
+        s, d = src[name], dst.get(name)
+        if d is None:
+            diff["missing"].append(name)
+        elif s.st_size != d.st_size:
+            diff["stale"].append(name)
+        elif abs(s.st_mtime - d.st_mtime) <= RECONCILE_MTIME_SLACK_S:
+            diff["identical"].append(name)  # copy (atomic) ikut menyalin mtime
+        else:
+            check.append(name)
 
-                    if trip in self.seen_triplets:
-                        continue
+    def compare(name):
+        s, d = src[name], dst[name]
+        reads = (src_index.lookup(name, s) is None) + (dst_index.lookup(name, d) is None)
+        try:
+            same = _indexed_md5(os.path.join(clean_dir, name), s, digests, src_index) == \
+                _indexed_md5(os.path.join(drive_dir, name), d, digests, dst_index)
+        except OSError:
+            same = False
+        return name, same, reads
+
+    if check:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or RECONCILE_WORKERS) as pool:
+            for name, same, reads in pool.map(compare, check):
+                diff["identical" if same else "stale"].append(name)
+                diff["hashed"] += reads
+    return diff
+
+def reconcile_run(clean_dir, drive_dir, ui, workers=None, dry_run=False):
+    """Samakan DRIVE_DIR dengan CLEAN_DIR: copy hanya yang missing / stale. Return Counter hasil."""
+    t0 = time.monotonic()
+    workers = workers or RECONCILE_WORKERS
+    digests = DigestCache()
+    diff = reconcile_diff(clean_dir, drive_dir, digests, workers)
+    ui.log(f"🔍 Reconcile: {len(diff['missing'])} missing, {len(diff['stale'])} stale, "
+           f"{len(diff['extra'])} extra, {len(diff['identical'])} identical "
+           f"(isi dibaca: {diff['hashed']} file, {time.monotonic() - t0:.1f}s)")
+    for name in diff["extra"][:20]:
+        ui.log(f"   ➕ Hanya ada di Drive: {name}")
+    if len(diff["extra"]) > 20:
+        ui.log(f"   … dan {len(diff['extra']) - 20} lainnya")
+
+    results = collections.Counter()
+    results["exists-identical"] = len(diff["identical"])
+    results["extra"] = len(diff["extra"])
+    todo = [(name, "missing") for name in diff["missing"]] + [(name, "stale") for name in diff["stale"]]
+    if dry_run:
+        for name, why in todo:
+            ui.log(f"   📝 Akan di-copy ({why}): {name}")
+        results["would-copy"] = len(todo)
+        return results
+
+    def copy_one(job):
+        name, why = job
+        src, dst = os.path.join(clean_dir, name), os.path.join(drive_dir, name)
+        try:
+            return name, why, copy_auto_replace(src, dst, digests), None
+        except Exception as e:
+            return name, why, None, e
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for name, why, st, err in pool.map(copy_one, todo):
+            src, dst = os.path.join(clean_dir, name), os.path.join(drive_dir, name)
+            appid = os.path.splitext(name)[0]
+            if err is not None:
+                ui.log(f"❌ Copy to Drive folder failed: {name} -> {err} — masuk antrean retry")
+                get_retry_queue().add(src, dst, str(err))
+                append_log("reconcile", src, appid, f"copy-failed: {err}", "", src, dst, why)
+                results[f"copy-failed: {err}"] += 1
+                continue
+            if st == "copied":
+                ui.log(f"✅ Copied to Drive ({why}): {name}")
+                get_retry_queue().discard(dst)
+            append_log("reconcile", src, appid, st, "", src, dst, why)
+            results[st] += 1
+    get_history().flush()
+    ui.log(f"Reconcile selesai: {results.get('copied', 0)} copied, "
+           f"{results.get('exists-identical', 0)} identical ({time.monotonic() - t0:.1f}s)")
+    return results
+
+def reconcile_gui_run(ui: UILogger):
+    try:
+        clean_dir = ensure_config_dir(CLEAN_DIR_FILE, "Pilih folder hasil cleaning (CLEAN_DIR)")
+        drive_dir = ensure_config_dir(DRIVE_DIR_FILE, "Pilih folder Google Drive Desktop tujuan (DRIVE_DIR)")
+        reconcile_run(clean_dir, drive_dir, ui)
+    except Exception as e:
+        ui.log(f"❌ Reconcile gagal: {e}")
 
-                    try:
-                        zmd5 = md5_file(path)
-                    except Exception:
-                        zmd5 = None
+# ========= AUTO-WATCH ROUTES =========
+def _glob_any(rel, patterns):
+    """Pola tanpa '/' dicocokkan ke nama file, pola dengan '/' ke path relatif (case-insensitive)."""
+    rel = rel.lower()
+    base = rel.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatchcase(rel if "/" in pat else base, pat.lower()) for pat in patterns)
 
-                    if zmd5 and zmd5 in self.seen_md5:
-                        self.ui.log(f"⏭️ Auto-Watch skip: {os.path.basename(path)} (sudah pernah diproses)")
-                        self.seen_triplets.add(trip)
-                        continue
+def _is_under(path, root):
+    return path.startswith(root.rstrip(os.sep) + os.sep)
 
-                    if not is_valid_manifest_zip(path):
-                        self.ui.log(f"❌ Auto-Watch: {os.path.basename(path)} bukan manifest, dilewati")
-                        append_log("validate", path, "", "skip_invalid", zmd5 or "", "", "", "no .lua/.manifest")
-                        self.seen_triplets.add(trip)
-                        continue
+class WatchRoute:
+    """Satu sumber Auto-Watch: folder (opsional rekursif + filter glob) -> pasangan CLEAN_DIR/DRIVE_DIR sendiri."""
+
+    def __init__(self, watch_dir, clean_dir, drive_dir, recursive=False, include=None, exclude=None, name=None):
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.clean_dir = clean_dir
+        self.drive_dir = drive_dir
+        self.recursive = recursive
+        self.include = list(include or ["*.zip"])
+        self.exclude = list(exclude or [])
+        self.name = name or os.path.basename(self.watch_dir.rstrip(os.sep)) or self.watch_dir
+
+    def rel(self, path):
+        """Path relatif terhadap watch_dir ('/' sebagai pemisah), None bila di luar route ini."""
+        if os.path.dirname(path) == self.watch_dir:
+            return os.path.basename(path)
+        if self.recursive and _is_under(path, self.watch_dir):
+            return os.path.relpath(path, self.watch_dir).replace(os.sep, "/")
+        return None
+
+    def matches(self, path):
+        rel = self.rel(path)
+        return rel is not None and _glob_any(rel, self.include) and not _glob_any(rel, self.exclude)
+
+def route_for(routes, path):
+    """Route untuk path: watch_dir terdalam yang cocok; bila sama dalam, urutan config."""
+    best = None
+    for r in routes:
+        if r.matches(path) and (best is None or len(r.watch_dir) > len(best.watch_dir)):
+            best = r
+    return best
+
+def watch_roots(routes):
+    """(folder, rekursif) yang perlu di-scan: folder sama digabung, sub-folder dari root rekursif tidak di-scan dua kali."""
+    merged = {}
+    for r in routes:
+        merged[r.watch_dir] = merged.get(r.watch_dir, False) or r.recursive
+    roots = []
+    for d, recursive in sorted(merged.items()):  # induk selalu tersortir sebelum anaknya
+        if not any(rec and _is_under(d, root) for root, rec in roots):
+            roots.append((d, recursive))
+    return roots
+
+def _as_list(v):
+    if v is None:
+        return None
+    return [v] if isinstance(v, str) else list(v)
+
+def parse_watch_routes(entries, clean_dir=None, drive_dir=None):
+    """Route dari config JSON; clean_dir/drive_dir yang tidak diisi memakai pasangan global."""
+    if isinstance(entries, dict):
+        entries = entries.get("routes")
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("routes harus list berisi minimal satu route")
+    routes = []
+    for i, e in enumerate(entries):
+        if not isinstance(e, dict) or not e.get("watch_dir"):
+            raise ValueError(f"routes[{i}]: watch_dir wajib diisi")
+        watch_dir = os.path.abspath(e["watch_dir"])
+        if not os.path.isdir(watch_dir):
+            raise ValueError(f"routes[{i}]: watch_dir tidak ditemukan: {watch_dir}")
+        c, d = e.get("clean_dir") or clean_dir, e.get("drive_dir") or drive_dir
+        if not c or not d:
+            raise ValueError(f"routes[{i}]: clean_dir / drive_dir belum diset")
+        routes.append(WatchRoute(watch_dir, _ensure_dir(os.path.abspath(c)), _ensure_dir(os.path.abspath(d)),
+                                 bool(e.get("recursive")), _as_list(e.get("include")), _as_list(e.get("exclude")),
+                                 e.get("name")))
+    return routes
+
+def load_watch_routes_file(path, clean_dir=None, drive_dir=None):
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_watch_routes(json.load(f), clean_dir, drive_dir)
+
+# ========= AUTO-WATCH BACKENDS =========
+class _InotifyBackend:
+    """
+    Linux inotify via ctypes (tanpa dependency): bangun hanya saat ada file selesai ditulis/dipindah.
+    Satu fd untuk semua root; root rekursif mendapat watch per sub-folder (sync_dirs setelah scan penuh).
+    """
+    name = "inotify"
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_IGNORED     = 0x00008000
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_ISDIR       = 0x40000000
+    IN_NONBLOCK    = 0o4000
+    IN_CLOEXEC     = 0o2000000
+    _EVENT         = struct.Struct("iIII")
+
+    def __init__(self, roots):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 gagal")
+        self._wds = {}  # wd -> folder
+        self._dirs = set()
+        self.degraded = False  # limit watch habis -> scan penuh berkala
+        try:
+            for d, _recursive in roots:
+                self._add(d, strict=True)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add(self, d, strict=False):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(d), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if strict:
+                raise OSError(err, f"inotify_add_watch gagal: {d}")
+            self.degraded = True
+            return
+        self._wds[wd] = d
+        self._dirs.add(d)
+
+    def sync_dirs(self, dirs):
+        """Tambah watch untuk sub-folder (root rekursif) yang ditemukan scan penuh."""
+        for d in dirs:
+            if d not in self._dirs:
+                self._add(d)
+
+    def wait(self, stop_event, timeout=None):
+        """
+        Return list path yang selesai ditulis (close-write) / dipindah ke folder,
+        [] bila timeout, atau None bila perlu scan penuh (queue overflow / folder baru).
+        """
+        if self.degraded:
+            timeout = POLL_INTERVAL_S if timeout is None else min(timeout, POLL_INTERVAL_S)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not stop_event.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                return None if self.degraded else []
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            paths, rescan, off = [], False, 0
+            while off + self._EVENT.size <= len(buf):
+                wd, mask, _cookie, name_len = self._EVENT.unpack_from(buf, off)
+                off += self._EVENT.size
+                name = buf[off:off + name_len].rstrip(b"\0")
+                off += name_len
+                if mask & self.IN_Q_OVERFLOW:
+                    return None
+                if mask & self.IN_IGNORED:
+                    self._dirs.discard(self._wds.pop(wd, None))
+                    continue
+                if mask & self.IN_ISDIR:
+                    rescan = True  # folder baru (root rekursif): scan penuh + pasang watch
+                    continue
+                if mask & self.IN_CREATE:
+                    continue  # file baru dibuat: tunggu close-write
+                if name and wd in self._wds:
+                    paths.append(os.path.join(self._wds[wd], os.fsdecode(name)))
+            if rescan:
+                return None
+            if paths:
+                return paths
+        return []
+
+    def activity(self, found):
+        pass
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except Exception:
+            pass
+
+class _PollBackend:
+    """
+    Polling adaptif: interval POLL_MIN_INTERVAL_S saat ada file baru, naik 2x per putaran sepi
+    sampai POLL_INTERVAL_S. Scan dilewati bila mtime semua folder yang dipantau (root + sub-folder
+    root rekursif) tidak berubah (maks. FULL_RESCAN_S).
+    """
+    name = "poll"
+
+    def __init__(self, roots):
+        self._dirs = [d for d, _recursive in roots]
+        self.interval = POLL_MIN_INTERVAL_S
+        self._dir_mtimes = None
+        self._last_full = 0.0
+
+    def sync_dirs(self, dirs):
+        self._dirs = list(dirs)
+
+    def _mtimes(self):
+        out = []
+        for d in self._dirs:
+            try:
+                out.append(os.stat(d).st_mtime_ns)
+            except OSError:
+                out.append(None)
+        return out
+
+    def wait(self, stop_event, timeout=None):
+        interval = self.interval if timeout is None else min(self.interval, timeout)
+        deadline = time.monotonic() + interval
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        mtimes = self._mtimes()
+        now = time.monotonic()
+        if mtimes == self._dir_mtimes and now - self._last_full < FULL_RESCAN_S:
+            return []  # file pending tetap dicek ulang oleh watcher
+        self._dir_mtimes = mtimes
+        self._last_full = now
+        return None
+
+    def activity(self, found):
+        if found:
+            self.interval = POLL_MIN_INTERVAL_S
+        else:
+            self.interval = min(POLL_INTERVAL_S, self.interval * 2)
+
+    def close(self):
+        pass
+
+def open_watch_backend(roots):
+    """roots: list (folder, rekursif) dari watch_roots()."""
+    if WATCH_BACKEND in ("auto", "inotify") and sys.platform.startswith("linux"):
+        try:
+            return _InotifyBackend(roots)
+        except Exception:
+            if WATCH_BACKEND == "inotify":
+                raise
+    return _PollBackend(roots)
+
+class SeenStore:
+    """
+    (path, size, mtime) yang sudah ditangani Auto-Watch, persisten (append-only) di WATCH_SEEN_DB
+    supaya restart tidak meng-hash ulang seluruh folder. Saat load, entri untuk file yang sudah dihapus
+    atau sudah berubah (size/mtime beda, tidak akan cocok lagi) dibuang dan file dipadatkan.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._set = set()
+        self._load()
+
+    @staticmethod
+    def _current(trip):
+        """Entri masih menggambarkan file di disk (stat gagal selain hilang -> dianggap masih berlaku)."""
+        try:
+            st = os.stat(trip[0])
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        return trip[1:] == (st.st_size, int(st.st_mtime))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        n_lines = 0
+        entries = set()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 3:
+                    continue
+                n_lines += 1
+                try:
+                    entries.add((parts[0], int(parts[1]), int(parts[2])))
+                except ValueError:
+                    continue
+        self._set = {trip for trip in entries if self._current(trip)}
+        if n_lines > len(self._set):
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for p, size, mtime in self._set:
+                    f.write(f"{p}\t{size}\t{mtime}\n")
+            os.replace(tmp, self.path)
+
+    def __contains__(self, trip):
+        with self._lock:
+            return trip in self._set
+
+    def add(self, trip):
+        with self._lock:
+            if trip in self._set:
+                return
+            self._set.add(trip)
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(f"{trip[0]}\t{trip[1]}\t{trip[2]}\n")
+            except Exception:
+                pass
+
+# ========= AUTO-WATCH THREAD =========
+class WatcherThread(threading.Thread):
+    """
+    Auto-Watch sebagai pipeline: thread ini = discovery (event/scan + cek stabilitas), lalu
+    worker validate+hash -> clean/repack -> copy, dihubungkan antrean terbatas (WATCH_QUEUE_SIZE).
+    Copy ke Drive yang lambat tidak lagi menahan hashing/cleaning file lain; bila antrean penuh,
+    tahap sebelumnya ikut menunggu (backpressure).
+    Satu thread melayani semua route (WatchRoute): satu backend, satu scan per root, worker,
+    DigestCache, SeenStore & history dipakai bersama; tiap file dikirim ke CLEAN_DIR/DRIVE_DIR route-nya.
+    """
+
+    def __init__(self, routes, ui: UILogger, stop_event: threading.Event):
+        super().__init__(daemon=True)
+        self.routes = list(routes)
+        self.roots = watch_roots(self.routes)
+        self._multi_dest = len({(r.clean_dir, r.drive_dir) for r in self.routes}) > 1
+        self.ui = ui
+        self.stop_event = stop_event
+        self.history = get_history()  # md5 yang sudah pernah diproses: lookup per file di DB
+        self.session_md5 = set()  # md5 yang sudah masuk pipeline sesi ini (belum tentu di DB)
+        self._seen_lock = threading.Lock()
+        self.inflight = set()  # trip yang sedang di pipeline (jangan di-queue dua kali)
+        self.hash_q = queue.Queue(WATCH_QUEUE_SIZE)
+        self.clean_q = queue.Queue(WATCH_QUEUE_SIZE)
+        self.copy_q = queue.Queue(WATCH_QUEUE_SIZE)
+        self.seen_triplets = SeenStore(WATCH_SEEN_DB)  # (path, size, mtime), persisten antar sesi
+        self.digests = DigestCache()  # dipakai bersama dengan process_one_zip
+        self.backend_name = ""
+        self.pending = {}  # path -> ((size, mtime_ns), monotonic saat terakhir berubah)
+        self.incomplete = {}  # path -> ((size, mtime_ns), monotonic) — stabil tapi belum ada EOCD
+        # pickup latency = waktu mulai proses - mtime file (detik)
+        self.metrics = {"pickups": 0, "latency_last_s": 0.0, "latency_avg_s": 0.0, "latency_max_s": 0.0}
+
+    def _record_pickup(self, mtime):
+        lat = max(0.0, time.time() - mtime)
+        with self._seen_lock:
+            m = self.metrics
+            m["pickups"] += 1
+            m["latency_last_s"] = lat
+            m["latency_avg_s"] += (lat - m["latency_avg_s"]) / m["pickups"]
+            m["latency_max_s"] = max(m["latency_max_s"], lat)
+        return lat
+
+    def _put(self, q, item):
+        """put() yang menunggu selama antrean penuh (backpressure) tapi tetap responsif ke stop."""
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _stage_loop(self, q, fn):
+        while not self.stop_event.is_set():
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                fn(item)
+            except Exception as e:
+                self.ui.log(f"⚠️ Auto-Watch error: {e}")
+                self._finish(item[0])
+
+    def _finish(self, trip):
+        self.seen_triplets.add(trip)
+        with self._seen_lock:
+            self.inflight.discard(trip)
+
+    def _already_processed(self, zmd5, route):
+        """Sudah pernah dikirim ke tujuan route ini? (satu tujuan: cukup cek tabel processed)."""
+        if not self.history.is_processed(zmd5):
+            return False
+        if not self._multi_dest:
+            return True
+        drive_dir = os.path.normcase(route.drive_dir)
+        return any(row["action"] == "process" and row["drive_target"]
+                   and os.path.normcase(os.path.dirname(row["drive_target"])) == drive_dir
+                   for row in self.history.query(md5=zmd5, limit=100))
+
+    def _label(self, path, route):
+        name = os.path.basename(path)
+        return f"{name} [{route.name}]" if len(self.routes) > 1 else name
+
+    def _hash_item(self, item):
+        trip, mtime, route = item
+        path = trip[0]
+        prep = inspect_stage(path, self.digests)
+        zmd5 = prep["zip_md5"]
+        key = (zmd5, route.drive_dir)
+
+        with self._seen_lock:
+            dup = bool(zmd5) and (key in self.session_md5 or self._already_processed(zmd5, route))
+            if zmd5 and not dup and prep["status"] == "ok":
+                self.session_md5.add(key)  # file lain dengan isi & tujuan sama yang menyusul -> skip
+        if dup:
+            self.ui.log(f"⏭️ Auto-Watch skip: {self._label(path, route)} (sudah pernah diproses)")
+            self._finish(trip)
+            return
+
+        if prep["status"] != "ok":
+            reason = prep["reason"] or prep["error"] or "no .lua/.manifest"
+            self.ui.log(f"❌ Auto-Watch: {self._label(path, route)} — {_invalid_label(reason)}, dilewati")
+            append_log("validate", path, "", "skip_invalid", zmd5 or "", "", "", reason)
+            self._finish(trip)
+            return
 
-                    self.ui.log(f"▶️ Auto-Watch processing: {os.path.basename(path)}")
-                    res = process_one_zip(path, self.clean_dir, self.drive_dir, self.ui)
-                    if zmd5:
-                        self.seen_md5.add(zmd5)
-                    self.seen_triplets.add(trip)
+        lat = self._record_pickup(mtime)
+        self.ui.log(f"▶️ Auto-Watch processing: {self._label(path, route)} (pickup {lat:.1f}s)")
+        if not self._put(self.clean_q, (trip, prep, route)):
+            self._finish_dropped(trip)
 
-                # jeda polling
-                for _ in range(POLL_INTERVAL_S * 10):
+    def _clean_item(self, item):
+        trip, prep, route = item
+        lookup_stage(prep)
+        if not reserve_budget(prep, self.ui, self.stop_event):
+            self._finish_dropped(trip)
+            return
+        clean_stage(prep)
+        if not self._put(self.copy_q, (trip, prep, route)):
+            discard_prep(prep)
+            self._finish_dropped(trip)
+
+    def _copy_item(self, item):
+        trip, prep, route = item
+        deliver_zip(prep, route.clean_dir, route.drive_dir, self.ui, self.digests)
+        self._finish(trip)
+
+    def _finish_dropped(self, trip):
+        # watcher dimatikan di tengah pipeline: jangan tandai seen, biar diproses sesi berikutnya
+        with self._seen_lock:
+            self.inflight.discard(trip)
+
+    def _scan(self):
+        """Scan penuh semua root sekali; return (file .zip, folder yang dipantau)."""
+        files, dirs = [], []
+        for root, recursive in self.roots:
+            if not recursive:
+                dirs.append(root)
+                files.extend(entry.path for entry in os.scandir(root)
+                             if entry.is_file() and entry.name.lower().endswith(".zip"))
+                continue
+            for d, subdirs, names in os.walk(root):
+                subdirs[:] = [s for s in subdirs if not s.startswith(".")]
+                dirs.append(d)
+                files.extend(os.path.join(d, n) for n in names if n.lower().endswith(".zip"))
+        return files, dirs
+
+    def _is_stable(self, path, stat, closed):
+        """File siap bila writer sudah close (inotify) atau size/mtime diam selama STABLE_WINDOW_S."""
+        if closed:
+            self.pending.pop(path, None)
+            return True
+        key = (stat.st_size, stat.st_mtime_ns)
+        now = time.monotonic()
+        prev = self.pending.get(path)
+        if prev is None:
+            if time.time() - stat.st_mtime >= STABLE_WINDOW_S:
+                return True  # sudah lama tidak disentuh (mis. file lama saat watcher start)
+            self.pending[path] = (key, now)
+            return False
+        if prev[0] != key:
+            self.pending[path] = (key, now)
+            return False
+        if now - prev[1] >= STABLE_WINDOW_S:
+            del self.pending[path]
+            return True
+        return False
+
+    def _handle(self, path, closed=False):
+        """Proses satu kandidat .zip; return True bila ada aktivitas (file baru / masih ditulis)."""
+        if not path.lower().endswith(".zip"):
+            return False
+        route = route_for(self.routes, path)
+        if route is None:
+            return False
+        try:
+            stat = os.stat(path)
+            trip = (path, stat.st_size, int(stat.st_mtime))
+        except FileNotFoundError:
+            self.pending.pop(path, None)
+            self.incomplete.pop(path, None)
+            return False
+        except Exception:
+            stat = None
+            trip = (path, 0, 0)
+
+        with self._seen_lock:
+            busy = trip in self.inflight
+        if busy or trip in self.seen_triplets:
+            self.pending.pop(path, None)
+            self.incomplete.pop(path, None)
+            return False
+
+        if stat is not None:
+            if not self._is_stable(path, stat, closed):
+                return True
+            # belum ada EOCD -> kemungkinan masih di-download; tunggu, jangan hash / tandai invalid
+            if not has_zip_eocd(path, stat.st_size):
+                key = (stat.st_size, stat.st_mtime_ns)
+                prev = self.incomplete.get(path)
+                if prev is None or prev[0] != key:
+                    self.incomplete[path] = (key, time.monotonic())
+                    return True
+                if time.monotonic() - prev[1] < STABLE_GIVEUP_S:
+                    return True
+            # diam terlalu lama tanpa EOCD -> lanjut validasi biasa (skip_invalid)
+            self.incomplete.pop(path, None)
+
+        with self._seen_lock:
+            self.inflight.add(trip)
+        if not self._put(self.hash_q, (trip, stat.st_mtime if stat else time.time(), route)):
+            self._finish_dropped(trip)
+        return True
+
+    def run(self):
+        try:
+            backend = open_watch_backend(self.roots)
+        except Exception as e:
+            self.ui.log(f"⚠️ Auto-Watch backend gagal ({e}), pakai polling")
+            backend = _PollBackend(self.roots)
+        self.backend_name = backend.name
+        for r in self.routes:
+            extra = " (rekursif)" if r.recursive else ""
+            if r.include != ["*.zip"] or r.exclude:
+                extra += f" include={','.join(r.include)}" + (f" exclude={','.join(r.exclude)}" if r.exclude else "")
+            self.ui.log(f"👀 Auto-Watch aktif di: {r.watch_dir}{extra} → {r.drive_dir} ({backend.name})")
+        workers = []
+        for q, fn, n, tag in ((self.hash_q, self._hash_item, WATCH_HASH_WORKERS, "hash"),
+                              (self.clean_q, self._clean_item, WATCH_CLEAN_WORKERS, "clean"),
+                              (self.copy_q, self._copy_item, WATCH_COPY_WORKERS, "copy")):
+            for i in range(max(1, n)):
+                t = threading.Thread(target=self._stage_loop, args=(q, fn), daemon=True,
+                                     name=f"ts-watch-{tag}-{i}")
+                t.start()
+                workers.append(t)
+        paths = None  # None -> scan penuh (awal sesi / overflow / polling)
+        while not self.stop_event.is_set():
+            try:
+                if paths is None:
+                    files, dirs = self._scan()
+                    backend.sync_dirs(dirs)
+                    candidates = [(p, False) for p in files]
+                else:
+                    # path dari inotify = close-write / moved-to -> writer sudah selesai
+                    candidates = [(p, backend.name == "inotify") for p in paths]
+                listed = {p for p, _ in candidates}
+                candidates += [(p, False) for p in list(self.pending) + list(self.incomplete) if p not in listed]
+                found = False
+                for path, closed in candidates:
                     if self.stop_event.is_set():
                         break
-                    time.sleep(0.1)
+                    if self._handle(path, closed):
+                        found = True
+                backend.activity(found)
+                # ada file pending -> bangun lagi untuk cek stabilitas walau tidak ada event
+                waiting = self.pending or self.incomplete
+                paths = backend.wait(self.stop_event, STABLE_WINDOW_S / 2 if waiting else None)
 
             except Exception as e:
                 self.ui.log(f"⚠️ Auto-Watch error: {e}")
+                paths = None
                 time.sleep(POLL_INTERVAL_S)
 
+        backend.close()
+        for t in workers:
+            t.join()
+        # sisa antrean yang belum sempat diproses: buang tempdir, tidak ditandai seen
+        while True:
+            try:
+                _trip, prep, _route = self.copy_q.get_nowait()
+            except queue.Empty:
+                break
+            discard_prep(prep)
+        self.history.flush()
+        m = self.metrics
+        if m["pickups"]:
+            self.ui.log(f"📈 Pickup latency: avg {m['latency_avg_s']:.1f}s, max {m['latency_max_s']:.1f}s "
+                        f"({m['pickups']} file)")
         self.ui.log("🛑 Auto-Watch dimatikan.")
 
 # ========= BATCH WORKER (manual) =========
-def batch_worker_run(file_list, ui: UILogger):
-    try:
-        clean_dir = ensure_config_dir(CLEAN_DIR_FILE, "Pilih folder hasil cleaning (CLEAN_DIR)")
-        drive_dir = ensure_config_dir(DRIVE_DIR_FILE, "Pilih folder Google Drive Desktop tujuan (DRIVE_DIR)")
-        ui.log(f"Output (CLEAN_DIR): {clean_dir}")
-        ui.log(f"Drive folder     : {drive_dir}")
-
-        total = len(file_list)
+def _batch_worker_count(n_files):
+    n = BATCH_WORKERS or (os.cpu_count() or 1)
+    return max(1, min(n, n_files))
+
+# Lokasi state yang dibaca worker (result cache, member manifest, index) -> ikut diteruskan ke worker
+_BATCH_WORKER_PATHS = ("HISTORY_DB", "RESULT_CACHE_DB", "INDEX_DIR")
+
+def _init_batch_worker(profile, temp_dir, paths):
+    globals().update(paths)
+    set_compress_profile(profile)
+    set_repack_temp_dir(temp_dir)
+
+def _make_batch_pool(workers):
+    if BATCH_POOL == "process":
+        # selalu spawn (juga di Linux): fork dari GUI yang punya banyak thread bisa mewarisi lock yang sedang
+        # dipegang thread lain (cache, index, history) -> deadlock di worker. Sama dengan exe Windows.
+        # Profil kompresi, folder temp & lokasi state bisa diganti saat runtime -> diteruskan lewat initializer
+        paths = {name: globals()[name] for name in _BATCH_WORKER_PATHS}
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_batch_worker, initargs=(COMPRESS_PROFILE, REPACK_TEMP_DIR, paths))
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ts-batch")
+
+def _inspect_and_lookup(src, digests=None):
+    """Langkah pertama batch paralel di worker: inspect_stage + lookup_stage."""
+    return lookup_stage(inspect_stage(src, digests))
+
+def _run_batch_parallel(jobs, clean_dir, drive_dir, ui: UILogger, workers, digests, results):
+    """
+    inspect + lookup lalu clean_stage (CPU) jalan paralel di pool; deliver_zip (copy + history) tetap di thread ini
+    dengan urutan input -> log & history urut, copy ke target yang sama tetap serial.
+    Tiket ResourceBudget diambil di sini (worker bisa proses terpisah) dari inspeksi worker, sebelum
+    clean_stage disubmit -> tidak ada baca central directory tambahan di proses ini. Hasil cache tanpa tiket.
+    Selama belum muat, hasil yang menunggu dikirim dulu supaya tempdir-nya lepas.
+    """
+    total = len(jobs)
+    window = workers * 2  # batasi jumlah hasil (tempdir) yang menunggu dikirim
+    todo = iter(jobs)
+    inspecting = collections.deque()
+    pending = collections.deque()
+    budget = get_resource_budget()
+    done = 0
+    # thread pool bisa berbagi DigestCache; process pool punya cache sendiri per worker
+    shared = (digests,) if BATCH_POOL == "thread" else ()
+
+    def result_of(src, fut):
+        try:
+            return fut.result()
+        except Exception as e:  # pool rusak (mis. worker mati)
+            return {"src": src, "status": "error", "error": str(e)}
+
+    def deliver_next():
+        nonlocal done
+        src, fut, ticket, wait_ms = pending.popleft()
+        prep = result_of(src, fut)
+        if ticket is not None:
+            prep["budget"] = ticket  # dilepas discard_prep setelah dikirim
+            prep["budget_wait_ms"] = wait_ms
+        ui.log(f"Processing: {os.path.basename(src)}")
+        results[deliver_zip(prep, clean_dir, drive_dir, ui, digests)] += 1
+        done += 1
+        ui.log(f"Progress: {done}/{total}")
+
+    def acquire(prep):
+        est = job_temp_estimate(prep["src"], prep["inspection"])
+        ticket = budget.try_acquire(est)
+        if ticket is None:
+            ui.log(f"⏳ Menunggu anggaran temp: {os.path.basename(prep['src'])} (~{est / (1 << 20):.0f} MB)")
+        while ticket is None and pending:
+            deliver_next()
+            ticket = budget.try_acquire(est)
+        if ticket is None:
+            ticket = budget.acquire(est)  # pipeline sendiri kosong: tunggu job Auto-Watch yang berjalan
+        return ticket
+
+    with _make_batch_pool(workers) as pool:
+        for src in itertools.islice(todo, window):
+            inspecting.append((src, pool.submit(_inspect_and_lookup, src, *shared)))
+        while inspecting:
+            src, fut = inspecting.popleft()
+            for nxt in itertools.islice(todo, 1):
+                inspecting.append((nxt, pool.submit(_inspect_and_lookup, nxt, *shared)))
+            prep = result_of(src, fut)
+            if prep["status"] != "ok" or prep["cached"]:
+                fut, ticket, wait_ms = concurrent.futures.Future(), None, 0.0
+                fut.set_result(prep)  # skip-invalid / error / hasil cache: tidak perlu clean maupun tiket
+            else:
+                t0 = time.perf_counter()
+                ticket = acquire(prep)
+                wait_ms = (time.perf_counter() - t0) * 1000.0
+                try:
+                    fut = pool.submit(clean_stage, prep)
+                except Exception:
+                    budget.release(ticket)
+                    raise
+            pending.append((src, fut, ticket, wait_ms))
+            if len(pending) >= window:
+                deliver_next()
+        while pending:
+            deliver_next()
+
+def run_batch(file_list, clean_dir, drive_dir, ui):
+    """Proses daftar zip ke clean_dir/drive_dir. Return Counter hasil (copied, error, skip-invalid, ...)."""
+    ui.log(f"Output (CLEAN_DIR): {clean_dir}")
+    ui.log(f"Drive folder     : {drive_dir}")
+
+    results = collections.Counter()
+    jobs = []
+    for src in file_list:
+        src = src.strip().strip("{}").strip('"')
+        if not src.lower().endswith(".zip"):
+            ui.log(f"Skipping (not .zip): {src}")
+            results["skip-not-zip"] += 1
+            continue
+        if not os.path.exists(src):
+            ui.log(f"File not found: {src}")
+            results["not-found"] += 1
+            continue
+        jobs.append(src)
+
+    digests = DigestCache()  # satu cache per run
+    comp_before = get_stage_stats().compression()
+    workers = _batch_worker_count(len(jobs))
+    if workers > 1:
+        ui.log(f"Parallel batch: {workers} worker ({BATCH_POOL})")
+        _run_batch_parallel(jobs, clean_dir, drive_dir, ui, workers, digests, results)
+    else:
+        total = len(jobs)
         done = 0
-
-        for src in file_list:
-            src = src.strip().strip("{}").strip('"')
-            if not src.lower().endswith(".zip"):
-                ui.log(f"Skipping (not .zip): {src}")
-                continue
-            if not os.path.exists(src):
-                ui.log(f"File not found: {src}")
-                continue
-
+        for src in jobs:
             ui.log(f"Processing: {os.path.basename(src)}")
-            process_one_zip(src, clean_dir, drive_dir, ui)
+            results[process_one_zip(src, clean_dir, drive_dir, ui, digests)] += 1
 
             done += 1
             ui.log(f"Progress: {done}/{total}")
 
-        ui.log("All files processed.")
+    get_history().flush()
+    ui.log("All files processed.")
+    comp_run = get_stage_stats().compression()
+    for profile, c in comp_run.items():
+        c.subtract(comp_before.get(profile, {}))
+    for line in format_compression(comp_run):
+        ui.log(line.replace("🗜", "🗜 Run ini —", 1))
+    if METRICS_ENABLED:
+        for line in format_stage_stats(get_stage_stats().snapshot()):
+            ui.log(line)
+    return results
+
+def batch_worker_run(file_list, ui: UILogger):
+    try:
+        clean_dir = ensure_config_dir(CLEAN_DIR_FILE, "Pilih folder hasil cleaning (CLEAN_DIR)")
+        drive_dir = ensure_config_dir(DRIVE_DIR_FILE, "Pilih folder Google Drive Desktop tujuan (DRIVE_DIR)")
+        run_batch(file_list, clean_dir, drive_dir, ui)
 
     except Exception as e:
         ui.log(f"❌ Fatal error: {e}")
-        messagebox.showerror("Error", str(e))
+        ui.alert("Error", str(e))
 
 # ========= UPDATE CHECKER =========
-def fetch_json(url, timeout=10):
+class _HttpResponse:
+    """Respons HTTP seragam untuk requests / urllib: status, header, body per chunk."""
+
+    def __init__(self, status, headers, read_chunks, close):
+        self.status = status
+        self.headers = headers
+        self._read_chunks = read_chunks
+        self._close = close
+
+    def header(self, name):
+        return self.headers.get(name) if self.headers is not None else None
+
+    def iter_chunks(self, size=1 << 15):
+        for chunk in self._read_chunks(size):
+            if chunk:
+                yield chunk
+
+    def close(self):
+        with contextlib.suppress(Exception):
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _http_get(url, headers=None, timeout=30):
+    """GET streaming; status non-2xx (304/416/404) dikembalikan, bukan exception."""
+    headers = dict(headers or {})
+    requests = _import_requests()
+    if requests is not None:
+        r = requests.get(url, headers=headers, stream=True, timeout=timeout)
+        return _HttpResponse(r.status_code, r.headers, lambda n: r.iter_content(chunk_size=n), r.close)
+    # fallback urllib
+    import urllib.request
+    import urllib.error
+    try:
+        resp = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        resp = e  # HTTPError juga file-like: code, headers, read()
+    return _HttpResponse(resp.getcode(), resp.headers, lambda n: iter(lambda: resp.read(n), b""), resp.close)
+
+def _load_update_cache():
+    try:
+        with open(UPDATE_CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _save_update_cache(cache):
+    tmp = UPDATE_CACHE_FILE + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp, UPDATE_CACHE_FILE)
+    except OSError:
+        pass
+
+def fetch_json(url, timeout=10, use_cache=True):
+    """Ambil manifest update; dengan cache -> request kondisional (ETag / If-Modified-Since), 304 pakai manifest tersimpan."""
+    cache = _load_update_cache() if use_cache else {}
+    cached = cache.get("manifest") if cache.get("url") == url else None
+    headers = {}
+    if isinstance(cached, dict):
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
     try:
-        if requests is not None:
-            r = requests.get(url, timeout=timeout)
-            r.raise_for_status()
-            return r.json()
-        # fallback urllib
-        with urllib.request.urlopen(url, timeout=timeout) as resp:
-            import json
-            return json.loads(resp.read().decode("utf-8"))
+        with _http_get(url, headers=headers, timeout=timeout) as resp:
+            if resp.status == 304 and isinstance(cached, dict):
+                return dict(cached, _not_modified=True)
+            if resp.status != 200:
+                raise RuntimeError(f"HTTP {resp.status}")
+            info = json.loads(b"".join(resp.iter_chunks()).decode("utf-8"))
+            if not isinstance(info, dict):
+                raise ValueError("manifest bukan object JSON")
+            if use_cache and (resp.header("ETag") or resp.header("Last-Modified")):
+                _save_update_cache({"url": url, "etag": resp.header("ETag"),
+                                    "last_modified": resp.header("Last-Modified"), "manifest": info})
+            return info
     except Exception as e:
         raise RuntimeError(f"Gagal ambil info update: {e}")
 
-def download_file(url, dest, ui: UILogger, timeout=30):
-    try:
-        if requests is not None:
-            with requests.get(url, stream=True, timeout=timeout) as r:
-                r.raise_for_status()
-                total = int(r.headers.get("content-length") or 0)
-                done = 0
-                with open(dest, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=1 << 15):
-                        if chunk:
-                            f.write(chunk)
-                            done += len(chunk)
-                            if total:
-                                pct = int(done * 100 / total)
-                                ui.log(f"⬇️ Downloading update… {pct}%")
+def _hash_file(path, h):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h
+
+def _download_part(url, part, ui, timeout):
+    """Satu percobaan: lanjutkan .part dengan Range (If-Range ETag/Last-Modified), 200 -> mulai dari nol.
+    Return sha256 (hashlib) seluruh isi .part setelah selesai."""
+    meta_path = part + ".json"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    meta = {}
+    if offset:
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+    validator = (meta.get("etag") or meta.get("last_modified")) if meta.get("url") == url else None
+    headers = {}
+    if offset and validator:
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+    else:
+        offset = 0
+    with _http_get(url, headers=headers, timeout=timeout) as resp:
+        if resp.status == 416 and offset:
+            # .part sudah lengkap (atau lebih panjang dari file) -> biarkan checksum yang memutuskan
+            return _hash_file(part, hashlib.sha256())
+        if resp.status not in (200, 206):
+            raise RuntimeError(f"HTTP {resp.status}")
+        if resp.status == 206 and offset:
+            h = _hash_file(part, hashlib.sha256())
+            mode = "ab"
+            ui.log(f"⏯️ Melanjutkan download dari {offset / (1 << 20):.1f} MB")
         else:
-            urllib.request.urlretrieve(url, dest)
-        return True
-    except Exception as e:
-        ui.log(f"❌ Gagal download update: {e}")
+            h, mode, offset = hashlib.sha256(), "wb", 0
+        length = int(resp.header("Content-Length") or 0)
+        total = offset + length if length else 0
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "etag": resp.header("ETag"), "last_modified": resp.header("Last-Modified")}, f)
+        done = offset
+        with open(part, mode) as f:
+            for chunk in resp.iter_chunks(UPDATE_CHUNK):
+                f.write(chunk)
+                h.update(chunk)
+                done += len(chunk)
+                if total:
+                    pct = int(done * 100 / total)
+                    ui.progress("download", f"⬇️ Downloading update… {pct}%", final=done >= total)
+        if total and done < total:
+            raise RuntimeError(f"koneksi terputus ({done}/{total} byte)")
+    return h
+
+def _valid_sha256(value):
+    """SHA-256 hex (64 karakter) dari latest.json, lowercase; "" bila kosong / formatnya salah."""
+    value = str(value or "").strip().lower()
+    return value if re.fullmatch(r"[0-9a-f]{64}", value) else ""
+
+def download_file(url, dest, ui: UILogger, timeout=30, sha256=None):
+    """
+    Download ke dest + UPDATE_PART_SUFFIX, resume dengan HTTP Range bila putus, cek SHA-256, lalu rename ke dest.
+    Tanpa sha256 valid dan UPDATE_REQUIRE_SHA256 -> tidak diunduh (return False).
+    """
+    part = dest + UPDATE_PART_SUFFIX
+    expected = _valid_sha256(sha256)
+    if not expected and UPDATE_REQUIRE_SHA256:
+        ui.log("❌ latest.json tanpa sha256 yang valid — update tidak diunduh (tidak bisa diverifikasi)")
         return False
+    restarted = False
+    for attempt in range(1, UPDATE_DOWNLOAD_ATTEMPTS + 1):
+        try:
+            digest = _download_part(url, part, ui, timeout).hexdigest()
+        except Exception as e:
+            ui.log(f"⚠️ Download update terputus (percobaan {attempt}/{UPDATE_DOWNLOAD_ATTEMPTS}): {e}")
+            if attempt < UPDATE_DOWNLOAD_ATTEMPTS:
+                time.sleep(min(UPDATE_RETRY_S * attempt, 30))
+            continue
+        if expected and digest != expected:
+            # isi .part salah (file di server berganti / korup) -> buang, ulang sekali dari nol
+            for p in (part, part + ".json"):
+                with contextlib.suppress(OSError):
+                    os.remove(p)
+            if restarted:
+                ui.log(f"❌ Checksum update tidak cocok: {digest} != {expected}")
+                return False
+            ui.log("⚠️ Checksum update tidak cocok, download ulang dari awal")
+            restarted = True
+            continue
+        if not expected:
+            ui.log("⚠️ latest.json tanpa sha256 — file update tidak diverifikasi")
+        try:
+            os.replace(part, dest)
+        except OSError as e:
+            ui.log(f"❌ Gagal menyimpan update: {e}")
+            return False
+        with contextlib.suppress(OSError):
+            os.remove(part + ".json")
+        if expected:
+            ui.log(f"🔐 SHA-256 cocok: {digest[:16]}…")
+        return True
+    ui.log("❌ Gagal download update (file .part disimpan, klik Check Update lagi untuk melanjutkan)")
+    return False
+
+def _update_dest(latest, dl_url):
+    import urllib.parse
+    ext = os.path.splitext(urllib.parse.urlparse(dl_url).path)[1] or ".exe"
+    return os.path.join(BASE_DIR, f"TSManager_v{latest}{ext}")
 
-def check_update(ui: UILogger, root: tk.Tk):
+_update_busy = threading.Lock()
+
+def check_update(ui: UILogger, root: "tk.Tk"):
+    """Tombol Check Update: fetch manifest & download di thread terpisah, dialog lewat ui.call_ui (thread Tk)."""
+    if not _update_busy.acquire(blocking=False):
+        ui.log("⏳ Update sedang dicek / diunduh…")
+        return
     ui.log("🔄 Checking update…")
+    threading.Thread(target=_check_update_worker, args=(ui,), daemon=True).start()
+
+def _check_update_worker(ui: UILogger):
+    from tkinter import messagebox
+    handed_off = False  # _offer_update (thread Tk) yang melepas _update_busy
     try:
         info = fetch_json(UPDATE_JSON_URL, timeout=12)
+        if not isinstance(info, dict):
+            raise ValueError("latest.json bukan objek JSON")
+        if info.get("_not_modified"):
+            ui.log("📎 Info update tidak berubah (304, cache)")
         latest = str(info.get("version") or "").strip()
-        dl_url = str(info.get("url") or "").strip()
-        changelog = str(info.get("changelog") or "").strip()
-
         if not latest:
-            messagebox.showwarning("Update", "Info versi tidak valid.")
+            ui.call_ui(messagebox.showwarning, "Update", "Info versi tidak valid.")
             return
-
         if latest == APP_VERSION:
             ui.log("✅ Sudah versi terbaru.")
-            messagebox.showinfo("Up to date", f"TSManager {APP_VERSION} sudah versi terbaru.")
+            ui.call_ui(messagebox.showinfo, "Up to date", f"TSManager {APP_VERSION} sudah versi terbaru.")
             return
-
+        ui.call_ui(_offer_update, ui, info)
+        handed_off = True
+    except Exception as e:
+        ui.log(f"❌ Update check failed: {e}")
+        with contextlib.suppress(Exception):
+            ui.call_ui(messagebox.showerror, "Update", str(e))
+    finally:
+        if not handed_off:
+            _update_busy.release()
+
+def _offer_update(ui: UILogger, info):
+    """Jalan di thread Tk: tanya user, lalu download di background (thread download yang melepas _update_busy)."""
+    from tkinter import messagebox
+    import webbrowser
+    started = False
+    try:
+        latest = str(info.get("version") or "").strip()
+        dl_url = str(info.get("url") or "").strip()
+        changelog = str(info.get("changelog") or "").strip()
         msg = f"Versi terbaru tersedia: {latest}\n\nChangelog:\n{changelog}\n\nUnduh dan jalankan versi baru?"
         if not messagebox.askyesno("Update Available", msg):
             return
-
         if not dl_url:
             # kalau URL kosong, buka halaman info
             webbrowser.open(UPDATE_JSON_URL)
             return
-
-        # download ke file TSManager_new.exe di folder yang sama
-        new_name = f"TSManager_v{latest}.exe"
-        dest = os.path.join(BASE_DIR, new_name)
-        ok = download_file(dl_url, dest, ui)
-        if not ok or not os.path.exists(dest):
-            messagebox.showerror("Update", "Gagal mengunduh versi baru.")
+        if UPDATE_REQUIRE_SHA256 and not _valid_sha256(info.get("sha256")):
+            ui.log("⚠️ latest.json tanpa sha256 — download otomatis dibatalkan")
+            if messagebox.askyesno(
+                    "Update", "latest.json tidak memuat checksum SHA-256, jadi file update tidak bisa diverifikasi "
+                              "dan tidak diunduh otomatis.\n\nBuka link download di browser (unduh manual)?"):
+                webbrowser.open(dl_url)
             return
+        threading.Thread(target=_download_update_worker, args=(ui, latest, dl_url, info.get("sha256")),
+                         daemon=True).start()
+        started = True
+    except Exception as e:
+        ui.log(f"❌ Update gagal: {e}")
+    finally:
+        if not started:
+            _update_busy.release()
 
+def _download_update_worker(ui: UILogger, latest, dl_url, sha256):
+    from tkinter import messagebox
+    try:
+        dest = _update_dest(latest, dl_url)
+        if not download_file(dl_url, dest, ui, sha256=sha256) or not os.path.exists(dest):
+            ui.call_ui(messagebox.showerror, "Update", "Gagal mengunduh versi baru.")
+            return
         ui.log(f"✅ Update diunduh: {dest}")
-        messagebox.showinfo(
-            "Update",
-            f"Berhasil mengunduh {new_name}.\nTutup aplikasi ini, kemudian jalankan file tersebut.\n"
+        ui.call_ui(
+            messagebox.showinfo, "Update",
+            f"Berhasil mengunduh {os.path.basename(dest)}.\nTutup aplikasi ini, kemudian jalankan file tersebut.\n"
             "Kamu bisa mengganti (rename) file baru menjadi nama exe lama jika mau replace."
         )
         # buka folder agar user mudah menemukan file
@@ -459,13 +3414,17 @@ def check_update(ui: UILogger, root: tk.Tk):
             os.startfile(BASE_DIR)
         except Exception:
             pass
-
     except Exception as e:
-        ui.log(f"❌ Update check failed: {e}")
-        messagebox.showerror("Update", str(e))
+        ui.log(f"❌ Update gagal: {e}")
+        ui.call_ui(messagebox.showerror, "Update", str(e))
+    finally:
+        _update_busy.release()
 
 # ========= GUI =========
 def build_gui():
+    import tkinter as tk
+    from tkinter import messagebox, filedialog
+
     root = tk.Tk()
     root.title(f"TSManager.v{APP_VERSION} — LocalSync + Auto-Watch + History + Update")
     root.geometry("940x600")
@@ -504,8 +3463,23 @@ def build_gui():
 
     tk.Button(row, text="🗂 Set CLEAN_DIR", command=set_clean_dir).pack(side="left", padx=5)
     tk.Button(row, text="🗂 Set DRIVE_DIR", command=set_drive_dir).pack(side="left", padx=5)
+    tk.Button(row, text="🧮 Rebuild Index",
+              command=lambda: threading.Thread(target=rebuild_indexes_run, args=(ui,), daemon=True).start()
+              ).pack(side="left", padx=5)
+    tk.Button(row, text="🔁 Reconcile",
+              command=lambda: threading.Thread(target=reconcile_gui_run, args=(ui,), daemon=True).start()
+              ).pack(side="left", padx=5)
+    tk.Button(row, text="📤 Export CSV",
+              command=lambda: threading.Thread(target=export_history_run, args=(ui,), daemon=True).start()
+              ).pack(side="left", padx=5)
     tk.Button(row, text="🔄 Check Update", command=lambda: check_update(ui, root)).pack(side="left", padx=5)
 
+    profile_var = tk.StringVar(value=COMPRESS_PROFILE)
+    tk.Label(row, text="🗜").pack(side="left")
+    tk.OptionMenu(row, profile_var, *COMPRESS_PROFILES,
+                  command=lambda name: (set_compress_profile(name), ui.log(f"🗜 Profil kompresi: {name}"))
+                  ).pack(side="left", padx=5)
+
     # Auto-Watch controls
     watch_frame = tk.Frame(root)
     watch_frame.pack(pady=6)
@@ -529,15 +3503,24 @@ def build_gui():
 
         clean_dir = ensure_config_dir(CLEAN_DIR_FILE, "Pilih folder hasil cleaning (CLEAN_DIR)")
         drive_dir = ensure_config_dir(DRIVE_DIR_FILE, "Pilih folder Google Drive Desktop (DRIVE_DIR)")
-        watch_dir = _read_path_optional(WATCH_DIR_FILE)
-        if not watch_dir or not os.path.isdir(watch_dir):
-            watch_dir = _pick_and_save_dir("Pilih folder untuk Auto-Watch (pantau .zip)", WATCH_DIR_FILE)
-            if not watch_dir:
-                messagebox.showwarning("Warning", "WATCH_DIR belum dipilih.")
+        if os.path.exists(WATCH_ROUTES_FILE):
+            try:
+                routes = load_watch_routes_file(WATCH_ROUTES_FILE, clean_dir, drive_dir)
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Auto-Watch", f"{os.path.basename(WATCH_ROUTES_FILE)} tidak valid:\n{e}")
                 return
+            ui.log(f"📋 {len(routes)} route dari {os.path.basename(WATCH_ROUTES_FILE)}")
+        else:
+            watch_dir = _read_path_optional(WATCH_DIR_FILE)
+            if not watch_dir or not os.path.isdir(watch_dir):
+                watch_dir = _pick_and_save_dir("Pilih folder untuk Auto-Watch (pantau .zip)", WATCH_DIR_FILE)
+                if not watch_dir:
+                    messagebox.showwarning("Warning", "WATCH_DIR belum dipilih.")
+                    return
+            routes = [WatchRoute(watch_dir, clean_dir, drive_dir)]
 
         watcher_stop_event.clear()
-        t = WatcherThread(watch_dir, clean_dir, drive_dir, ui, watcher_stop_event)
+        t = WatcherThread(routes, ui, watcher_stop_event)
         t.start()
         watcher_thread["ref"] = t
         btn_watch.config(text="⏹ Stop Auto-Watch")
@@ -545,11 +3528,27 @@ def build_gui():
     btn_watch = tk.Button(watch_frame, text="▶ Start Auto-Watch", command=toggle_watch)
     btn_watch.pack(side="left", padx=5)
 
+    # Panel throughput (p50/p95 per tahap, files/min, MB/s)
+    stats_var = tk.StringVar(value="")
+    if METRICS_ENABLED:
+        tk.Label(root, textvariable=stats_var, anchor="w", justify="left",
+                 font=("Consolas", 9)).pack(fill="x", padx=12)
+
+        def refresh_stats():
+            snap = get_stage_stats().snapshot()
+            if snap["files"]:
+                stats_var.set("\n".join(format_stage_stats(snap)))
+            root.after(2000, refresh_stats)
+
+        refresh_stats()
+
     # Text log
     txt = tk.Text(root, height=20)
     txt.pack(fill="both", expand=True, padx=12, pady=8)
     ui = UILogger(root, txt)
     ui.schedule(200)
+    retry_stop_event = threading.Event()
+    RetryWorker(ui, retry_stop_event).start()
 
     # Run button
     def run_now():
@@ -579,22 +3578,203 @@ def build_gui():
 
     # Footer
     cfg = tk.Label(root, text=(
-        f"Version: {APP_VERSION}  •  Log: logs/tsmanager_log.csv  •  Riwayat ZIP: processed_md5.txt  •  Auto-Watch: {POLL_INTERVAL_S}s"
+        f"Version: {APP_VERSION}  •  Log & riwayat ZIP: logs/tsmanager.db (Export CSV → logs/tsmanager_log.csv)  •  Auto-Watch: {POLL_INTERVAL_S}s"
     ))
     cfg.pack(pady=4)
 
     def on_close():
+        retry_stop_event.set()
         if watcher_thread["ref"] and watcher_thread["ref"].is_alive():
             watcher_stop_event.set()
             time.sleep(0.2)
+        get_history().flush()
         root.destroy()
 
     root.protocol("WM_DELETE_WINDOW", on_close)
     return root
 
+# ========= CLI / DAEMON (headless) =========
+CLI_COMMANDS = ("process", "watch", "reconcile", "daemon", "stats")
+
+# exit code CLI
+EXIT_OK      = 0
+EXIT_FAILED  = 1  # ada file gagal diproses / gagal di-copy
+EXIT_USAGE   = 2  # argumen / konfigurasi salah
+EXIT_ABORTED = 130  # dihentikan (Ctrl+C)
+
+_FAILED_RESULTS = ("error", "not-found", "corrupt")
+
+def _load_cli_config(path):
+    """Config JSON daemon/CLI: {"clean_dir": ..., "drive_dir": ..., "watch_dir": ..., "routes": [...]}."""
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    if not isinstance(cfg, dict):
+        raise ValueError(f"{path}: isi config harus object JSON")
+    return cfg
+
+def _resolve_dir(flag_value, cfg, key, pathfile, required=True, create=True):
+    """Urutan: flag CLI > config file > *_DIR.txt (tanpa dialog pemilih folder)."""
+    p = flag_value or cfg.get(key) or _read_path_optional(pathfile)
+    if not p:
+        if required:
+            raise ValueError(f"{key} belum diset (pakai --{key.replace('_', '-')} atau --config)")
+        return None
+    p = os.path.abspath(p)
+    if create:
+        return _ensure_dir(p)
+    if not os.path.isdir(p):
+        raise ValueError(f"{key} tidak ditemukan: {p}")
+    return p
+
+def _exit_code(results):
+    if any(results.get(k) for k in _FAILED_RESULTS):
+        return EXIT_FAILED
+    if any(k.startswith("copy-failed") for k in results):
+        return EXIT_FAILED
+    return EXIT_OK
+
+def _run_watchers(routes, ui, pid_file=None):
+    """Jalankan Auto-Watch (semua route dalam satu watcher) sampai Ctrl+C / SIGTERM."""
+    stop_event = threading.Event()
+
+    def on_signal(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    if pid_file:
+        _write_path(pid_file, str(os.getpid()))
+    watcher = WatcherThread(routes, ui, stop_event)
+    watcher.start()
+    retry = RetryWorker(ui, stop_event)
+    retry.start()
+    try:
+        while watcher.is_alive() and not stop_event.is_set():
+            stop_event.wait(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        watcher.join()
+        retry.join()
+        get_history().flush()
+        if pid_file:
+            try:
+                os.remove(pid_file)
+            except OSError:
+                pass
+    return EXIT_OK
+
+def build_cli_parser():
+    ap = argparse.ArgumentParser(prog="TSManager", description=f"TSManager {APP_VERSION} (headless)")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", help="file JSON berisi clean_dir / drive_dir / watch_dir / routes")
+    common.add_argument("--clean-dir", help="folder hasil cleaning (CLEAN_DIR)")
+    common.add_argument("--drive-dir", help="folder Google Drive Desktop (DRIVE_DIR)")
+    common.add_argument("--json", action="store_true", help="log sebagai JSON per baris")
+    common.add_argument("--profile", choices=sorted(COMPRESS_PROFILES),
+                        help=f"profil kompresi zip hasil (default: profile di config / {COMPRESS_PROFILE})")
+    common.add_argument("--temp-dir", help="folder temp repack (default: temp_dir di config / temp sistem)")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("process", parents=[common], help="proses satu/lebih file .zip")
+    p.add_argument("zips", nargs="+")
+    p.add_argument("--workers", type=int, help="jumlah worker batch (0 = otomatis)")
+
+    p = sub.add_parser("watch", parents=[common], help="Auto-Watch satu/lebih folder (foreground)")
+    p.add_argument("watch_dirs", nargs="+", metavar="watch_dir")
+    p.add_argument("--recursive", action="store_true", help="ikut pantau sub-folder")
+    p.add_argument("--include", action="append", help="glob file yang diproses (default *.zip, bisa diulang)")
+    p.add_argument("--exclude", action="append", help="glob file/path yang dilewati (bisa diulang)")
+
+    p = sub.add_parser("reconcile", parents=[common], help="samakan DRIVE_DIR dengan CLEAN_DIR (missing/stale)")
+    p.add_argument("--workers", type=int, help=f"hash/copy paralel (default {RECONCILE_WORKERS})")
+    p.add_argument("--dry-run", action="store_true", help="tampilkan diff saja, tanpa copy")
+
+    p = sub.add_parser("daemon", parents=[common], help="Auto-Watch jangka panjang dari config/flag")
+    p.add_argument("--watch-dir", help="folder yang dipantau (default: routes / watch_dir di config, "
+                                       "lalu watch_routes.json)")
+    p.add_argument("--pid-file", help="tulis PID ke file ini selama daemon jalan")
+
+    p = sub.add_parser("stats", help="p50/p95 per tahap & throughput dari history")
+    p.add_argument("--last", type=int, default=METRICS_WINDOW, help="jumlah file terakhir (default: %(default)s)")
+    p.add_argument("--json", action="store_true", help="output JSON")
+    return ap
+
+def stats_run(last, ui, json_mode=False):
+    snap = stage_stats_from_history(last)
+    if json_mode:
+        print(json.dumps(snap), flush=True)
+    elif not snap["files"]:
+        ui.log("Belum ada data metrik di history.")
+    else:
+        for line in format_stage_stats(snap):
+            ui.log(line)
+    return EXIT_OK
+
+def cli_main(argv):
+    global BATCH_WORKERS
+    args = build_cli_parser().parse_args(argv)
+    ui = ConsoleLogger(json_mode=args.json)
+    if args.command == "stats":
+        try:
+            return stats_run(args.last, ui, args.json)
+        finally:
+            get_history().close()
+    try:
+        cfg = _load_cli_config(args.config)
+        # daemon dengan routes: tiap route boleh punya clean_dir/drive_dir sendiri -> global opsional
+        routes_cfg = None
+        if args.command == "daemon" and not args.watch_dir:
+            routes_cfg = cfg.get("routes")
+            if routes_cfg is None and not cfg.get("watch_dir") and os.path.exists(WATCH_ROUTES_FILE):
+                with open(WATCH_ROUTES_FILE, "r", encoding="utf-8") as f:
+                    routes_cfg = json.load(f)
+        clean_dir = _resolve_dir(args.clean_dir, cfg, "clean_dir", CLEAN_DIR_FILE, required=routes_cfg is None)
+        drive_dir = _resolve_dir(args.drive_dir, cfg, "drive_dir", DRIVE_DIR_FILE, required=routes_cfg is None)
+        routes = None
+        if args.command == "watch":
+            routes = [WatchRoute(_resolve_dir(d, {}, "watch_dir", WATCH_DIR_FILE, create=False), clean_dir, drive_dir,
+                                 args.recursive, args.include, args.exclude)
+                      for d in args.watch_dirs]
+        elif routes_cfg is not None:
+            routes = parse_watch_routes(routes_cfg, clean_dir, drive_dir)
+        elif args.command == "daemon":
+            watch_dir = _resolve_dir(args.watch_dir, cfg, "watch_dir", WATCH_DIR_FILE, create=False)
+            routes = [WatchRoute(watch_dir, clean_dir, drive_dir)]
+        if args.profile or cfg.get("profile"):
+            set_compress_profile(args.profile or cfg["profile"])
+        if args.temp_dir or cfg.get("temp_dir"):
+            set_repack_temp_dir(args.temp_dir or cfg["temp_dir"])
+    except (OSError, ValueError) as e:
+        ui.log(f"❌ Config error: {e}")
+        return EXIT_USAGE
+
+    _ensure_dir(LOGS_DIR)
+    get_history()
+    try:
+        if args.command in ("process", "reconcile"):
+            get_retry_queue().run_due(ui)  # sisa copy gagal dari run sebelumnya
+        if args.command == "process":
+            if args.workers is not None:
+                BATCH_WORKERS = args.workers
+            return _exit_code(run_batch([os.path.abspath(z) for z in args.zips], clean_dir, drive_dir, ui))
+        if args.command == "reconcile":
+            return _exit_code(reconcile_run(clean_dir, drive_dir, ui, args.workers, args.dry_run))
+        return _run_watchers(routes, ui, pid_file=getattr(args, "pid_file", None))
+    except KeyboardInterrupt:
+        ui.log("🛑 Dihentikan.")
+        return EXIT_ABORTED
+    finally:
+        get_history().flush()
+
 # ========= MAIN =========
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # wajib untuk process pool di exe PyInstaller
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS + ("-h", "--help"):
+        sys.exit(cli_main(sys.argv[1:]))
     _ensure_dir(LOGS_DIR)
-    ensure_log_headers()
+    get_history()
     app = build_gui()
     app.mainloop()